@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Awaitable, Callable
+from events import bus, ATTENDANCE_FLUSHED
+
+logger = logging.getLogger(__name__)
+
+ATTENDANCE_LOG = os.getenv("ATTENDANCE_LOG") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "attendance.log")
+ATTENDANCE_FLUSH_SECONDS = float(os.getenv("ATTENDANCE_FLUSH_SECONDS") or 3.0)
+ATTENDANCE_FLUSH_BATCH = 500
+
+Writer = Callable[[list[dict]], Awaitable[None]]
+
+class WriteBehindBuffer:
+    """
+    Write-behind store for attendance records, keyed by (session_id, student_id).
+    Every change is appended to a local JSON-lines log before anything else, and a
+    background task writes the latest version of changed records to the database
+    in small batches. After a successful write a {"flushed": seq} marker is logged;
+    on startup entries newer than the last marker are replayed, so a crash loses at
+    most what the OS had not written out yet.
+    """
+    def __init__(self, path: str, interval: float = 3.0, batch_size: int = 500):
+        self.path = path
+        self.interval = interval
+        self.batch_size = batch_size
+        self.records_written = 0
+        self.last_error: str | None = None
+        self._seq = 0
+        self._dirty: dict[tuple[int, int], tuple[int, dict]] = {}
+        self._file = None
+        self._writer: Writer | None = None
+        self._task: asyncio.Task | None = None
+        self._wake: asyncio.Event | None = None
+
+    def put(self, record: dict):
+        """Logs `record` (session_id, student_id, in_time, out_time, confidence) and queues it for the DB."""
+        self._seq += 1
+        key = (int(record["session_id"]), int(record["student_id"]))
+        self._dirty[key] = (self._seq, record)
+        if self._file is not None:
+            self._file.write(json.dumps({"seq": self._seq, "r": record}) + "\n")
+            self._file.flush()
+
+    def flush_soon(self):
+        """Asks the background task to write now instead of at the next interval."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def start(self, writer: Writer):
+        self._writer = writer
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        torn = self._replay()
+        self._file = open(self.path, "a", encoding="utf-8")
+        if torn:
+            # Keep the next entry off the half-written line a crash left behind.
+            self._file.write("\n")
+        self._wake = asyncio.Event()
+        if self._dirty:
+            logger.info("Replaying %d unsaved attendance records from %s", len(self._dirty), self.path)
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def has_pending(self, session_id: int) -> bool:
+        """True while records of `session_id` are not in the database yet."""
+        return any(key[0] == session_id for key in self._dirty)
+
+    def is_pending(self, session_id: int, student_id: int) -> bool:
+        """True while this student's latest record of `session_id` is not in the database yet."""
+        return (session_id, student_id) in self._dirty
+
+    def stats(self) -> dict[str, object]:
+        return {
+            "log": self.path,
+            "pending": len(self._dirty),
+            "records_written": self.records_written,
+            "last_error": self.last_error,
+        }
+
+    async def flush(self):
+        """Writes pending records, oldest first, until none are left or a write fails."""
+        if self._writer is None:
+            return
+        if self._file is not None and self._dirty:
+            # One fsync per flush rather than per event.
+            await asyncio.to_thread(os.fsync, self._file.fileno())
+        written: set[int] = set()
+        while self._dirty:
+            batch = sorted(self._dirty.items(), key=lambda item: item[1][0])[:self.batch_size]
+            try:
+                await self._writer([record for _, (_, record) in batch])
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning("Attendance write failed, keeping %d records for retry: %s", len(self._dirty), e)
+                break
+            self.last_error = None
+            self.records_written += len(batch)
+            written.update(key[0] for key, _ in batch)
+            for key, (seq, _) in batch:
+                # A record that changed during the write stays dirty with its newer seq.
+                if self._dirty.get(key, (None,))[0] == seq:
+                    del self._dirty[key]
+            # Every entry up to here is either written or superseded by a newer, still pending one.
+            self._log_flushed(batch[-1][1][0])
+        else:
+            self._compact()
+        if written:
+            # Lets the live attendance store free sessions that are fully written now.
+            bus.publish(ATTENDANCE_FLUSHED, {"session_ids": sorted(written)})
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def _log_flushed(self, seq: int):
+        if self._file is not None:
+            self._file.write(json.dumps({"flushed": seq}) + "\n")
+            self._file.flush()
+
+    def _compact(self):
+        """Starts a fresh log once everything in it has been written."""
+        if self._file is None or self._dirty or self._file.tell() == 0:
+            return
+        self._file.truncate(0)
+
+    def _replay(self) -> bool:
+        """Loads entries newer than the last flushed marker; True if the log ends mid-line."""
+        if not os.path.exists(self.path):
+            return False
+        flushed = 0
+        entries: list[tuple[int, dict]] = []
+        line = ""
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line torn by a crash mid-write.
+                    continue
+                if "flushed" in entry:
+                    flushed = max(flushed, int(entry["flushed"]))
+                elif "seq" in entry:
+                    entries.append((int(entry["seq"]), entry["r"]))
+        for seq, record in entries:
+            self._seq = max(self._seq, seq)
+            if seq > flushed:
+                key = (int(record["session_id"]), int(record["student_id"]))
+                if self._dirty.get(key, (0,))[0] < seq:
+                    self._dirty[key] = (seq, record)
+        self._seq = max(self._seq, flushed)
+        return bool(line) and not line.endswith("\n")
+
+
+buffer = WriteBehindBuffer(ATTENDANCE_LOG, interval=ATTENDANCE_FLUSH_SECONDS, batch_size=ATTENDANCE_FLUSH_BATCH)
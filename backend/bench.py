@@ -0,0 +1,133 @@
+"""
+End-to-end benchmark of the recognition pipeline on a recorded clip (see replay.py).
+
+    python bench.py clips/room101.mkv                # every frame, as fast as possible
+    python bench.py clips/room101.mkv --realtime     # paced like the live camera
+    python bench.py clips/room101.mkv --passthrough  # the overlay=client pipeline
+    python bench.py clips/room101.mkv --json out.json
+
+The clip is served as a replay: source to a FaceDetectionTrack, which runs exactly
+as it does behind /offer (executor hand-off, prepare, detection, drawing, yuv420p
+conversion, attendance events); only the WebRTC sender's 30 fps clock is skipped.
+Reports throughput, per-stage latency (decode, prepare, detect, spoof, embed,
+search, draw, convert) and the check-in/out events the track publishes on the bus.
+Check-in debouncing follows the wall clock, so fast runs may merge visits.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from aiortc.mediastreams import VIDEO_TIME_BASE
+import detect
+from capture import register_reader
+from events import bus, SESSION_EVENT
+from replay import REPLAY_PREFIX, ClipSource
+from vstrack import FaceDetectionTrack
+
+STAGES = ("prepare", "detect", "spoof", "embed", "search", "draw", "convert", "total")
+BENCH_SESSION_ID = -1   # never written: the attendance buffer is not started here
+
+class BenchTrack(FaceDetectionTrack):
+    """FaceDetectionTrack without the sender's frame clock, so recv() returns as soon as it can."""
+    async def next_timestamp(self):
+        return 0, VIDEO_TIME_BASE
+
+def _summary(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {"count": 0}
+    ms = sorted(v * 1000 for v in values)
+    return {
+        "count": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 2),
+        "p50_ms": round(ms[len(ms) // 2], 2),
+        "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 2),
+        "max_ms": round(ms[-1], 2),
+    }
+
+async def _run(path: str, realtime: bool, max_frames: int, passthrough: bool) -> dict[str, object]:
+    url = f"{REPLAY_PREFIX}{path}"
+    source = register_reader(url, ClipSource(path, realtime=realtime, loop=False))
+    # Every enrolled student, so no recognition is discarded as "not on the roster".
+    students = {int(label): None for label in set(detect.y_train)}
+    track = BenchTrack(students, session_id=BENCH_SESSION_ID, source=url, annotate=not passthrough)
+    track.stage_timings = []
+
+    events = []
+    start = time.perf_counter()
+    frames = 0
+
+    async def on_session_event(event: dict):
+        events.append({
+            "seq": track._last_seq,
+            "elapsed": round(time.perf_counter() - start, 3),
+            "student_id": event["student_id"],
+            "action": event["action"],
+            "confidence": event["confidence"],
+        })
+
+    bus.subscribe(SESSION_EVENT, on_session_event)
+    try:
+        while not max_frames or frames < max_frames:
+            last_seq = track._last_seq
+            await track.recv()
+            if track._last_seq == last_seq:
+                if source.finished.is_set() and source.read()[1] == last_seq:
+                    break
+                await asyncio.sleep(0.001)
+                continue
+            frames += 1
+        if track._analysis is not None:
+            await asyncio.gather(track._analysis, return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        await bus.drain()
+    finally:
+        bus.unsubscribe(SESSION_EVENT, on_session_event)
+        track.stop()
+
+    per_stage: dict[str, list[float]] = {stage: [] for stage in STAGES}
+    for timings in track.stage_timings:
+        for stage, seconds in timings.items():
+            per_stage[stage].append(seconds)
+    # Decoding runs on the source thread, overlapped with inference; only its mean is known.
+    stages: dict[str, dict[str, float]] = {"decode": {"count": source.frames_decoded}}
+    if source.frames_decoded:
+        stages["decode"]["mean_ms"] = round(source.decode_seconds / source.frames_decoded * 1000, 2)
+    stages.update({stage: _summary(values) for stage, values in per_stage.items()})
+    return {
+        "clip": path,
+        "mode": ("realtime" if realtime else "fast") + (", passthrough" if passthrough else ""),
+        "frames": frames,
+        "frames_analysed": len(track.stage_timings),
+        "frames_decoded": source.frames_decoded,
+        "frames_dropped": source.frames_dropped,
+        "seconds": round(elapsed, 3),
+        "fps": round(frames / elapsed, 2) if elapsed > 0 else 0.0,
+        "stages": stages,
+        "check_ins": sorted({e["student_id"] for e in events if e["action"] == "in"}),
+        "events": events,
+    }
+
+def run(path: str, realtime: bool = False, max_frames: int = 0, passthrough: bool = False) -> dict[str, object]:
+    return asyncio.run(_run(path, realtime, max_frames, passthrough))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the recognition pipeline on a recorded clip")
+    parser.add_argument("clip")
+    parser.add_argument("--realtime", action="store_true", help="pace frames by their recorded timestamps")
+    parser.add_argument("--passthrough", action="store_true", help="relay frames and analyse in the background (overlay=client)")
+    parser.add_argument("--frames", type=int, default=0, help="stop after N frames sent")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = run(args.clip, realtime=args.realtime, max_frames=args.frames, passthrough=args.passthrough)
+    print(f"{report['frames']} frames in {report['seconds']}s -> {report['fps']} fps ({report['mode']}, {report['frames_analysed']} analysed, {report['frames_dropped']} dropped)")
+    for stage, summary in report["stages"].items():
+        if stage == "decode" and summary["count"]:
+            print(f"  {stage:<8} mean {summary['mean_ms']:>8.2f} ms  (n={summary['count']}, on the source thread)")
+        elif summary["count"]:
+            print(f"  {stage:<8} mean {summary['mean_ms']:>8.2f} ms  p50 {summary['p50_ms']:>8.2f}  p95 {summary['p95_ms']:>8.2f}  max {summary['max_ms']:>8.2f}  (n={summary['count']})")
+    print(f"  check-ins: {report['check_ins']} ({len(report['events'])} events)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,58 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL") or 30.0)
+READ_CACHE_SIZE = 4096
+
+class TTLCache:
+    """
+    In-process LRU cache whose entries also expire after `ttl` seconds.
+    Keys are tuples whose first element names the kind of data, e.g. ("class", 7),
+    so write paths can drop one entry or every entry of a kind. Other workers
+    only see a change once their copy expires, which bounds staleness to `ttl`.
+    """
+    def __init__(self, maxsize: int = READ_CACHE_SIZE, ttl: float = READ_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def invalidate_kind(self, kind: str):
+        for key in [k for k in self._data if isinstance(k, tuple) and k and k[0] == kind]:
+            del self._data[key]
+
+    def stats(self) -> dict[str, object]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "ttl": self.ttl,
+        }
+
+
+read_cache = TTLCache()
@@ -0,0 +1,220 @@
+import asyncio
+import random
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+import cv2
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+from av import VideoFrame
+from replay import REPLAY_PREFIX, ClipSource
+from shared import (
+    LatestFrameBuffer, SOURCE_CONNECTING, SOURCE_LIVE, SOURCE_OFFLINE, SOURCE_RECONNECTING, SOURCE_STOPPED,
+    inference_size, rtmp_stream, video_frame_to_bgr,
+)
+
+RTMP_PREFIX = "rtmp:"
+CLIENT_PREFIX = "client:"
+OPEN_TIMEOUT_MS = 5000
+READ_TIMEOUT_MS = 5000
+
+class LatestFrameReader(LatestFrameBuffer):
+    """
+    Pulls frames from a cv2.VideoCapture source on a background thread and keeps
+    only the most recent one, so consumers on the event loop never block on the camera.
+    Connecting also happens on that thread, retrying with exponential backoff and jitter.
+    MJPEG/HTTP captures cannot decode at reduced size; frames are stored as decoded
+    and only the ones a consumer processes are scaled down, in prepare().
+    """
+    def __init__(self, url: str | None, base_delay: float = 0.5, max_delay: float = 30.0, max_age: float = 2.0):
+        super().__init__(url, max_age=max_age)
+        self.url = url
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures = 0
+        self.next_retry_at: float | None = None
+        self.state = SOURCE_CONNECTING
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"capture:{url}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.state = SOURCE_STOPPED
+
+    def stats(self) -> dict[str, object]:
+        out = super().stats()
+        out["failures"] = self.failures
+        if self.next_retry_at is not None:
+            out["retry_in"] = round(max(0.0, self.next_retry_at - time.monotonic()), 3)
+        return out
+
+    def prepare(self, frame):
+        h, w = frame.shape[:2]
+        size = inference_size(w, h)
+        if size == (w, h):
+            return frame
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    def _backoff(self):
+        """Sleeps before the next attempt: full jitter over an exponentially growing window."""
+        self.failures += 1
+        self.state = SOURCE_RECONNECTING
+        window = min(self.max_delay, self.base_delay * (2 ** min(self.failures - 1, 16)))
+        delay = random.uniform(0, window)
+        self.next_retry_at = time.monotonic() + delay
+        self._stop.wait(delay)
+        self.next_retry_at = None
+
+    def _open(self):
+        print(f"[capture] Connecting to {self.url}...")
+        # Bound how long a dead camera can hold this thread inside OpenCV.
+        cap = cv2.VideoCapture(self.url, cv2.CAP_ANY, [
+            cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, OPEN_TIMEOUT_MS,
+            cv2.CAP_PROP_READ_TIMEOUT_MSEC, READ_TIMEOUT_MS,
+        ])
+        if not cap.isOpened():
+            print(f"[capture] Could not open video stream: {self.url}")
+            self.last_error = "open failed"
+            cap.release()
+            return None
+        # Keep OpenCV's own queue as short as possible; we only want the newest frame.
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        print(f"[capture] Connected to {self.url}.")
+        return cap
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                cap = self._open()
+            except Exception as e:
+                self.last_error = str(e)
+                cap = None
+            if cap is None:
+                self._backoff()
+                continue
+
+            try:
+                while not self._stop.is_set():
+                    ret, frame = cap.read()
+                    if not ret:
+                        print(f"[capture] Could not read frame from {self.url}, potential connection loss.")
+                        self.last_error = "read failed"
+                        break
+                    if self.state != SOURCE_LIVE:
+                        self.state = SOURCE_LIVE
+                        self.failures = 0
+                    self.put(frame)
+            finally:
+                cap.release()
+            if not self._stop.is_set():
+                self._backoff()
+
+
+class RemoteTrackSource(LatestFrameBuffer):
+    """
+    Frames of an inbound WebRTC video track, e.g. the teacher's browser camera.
+    aiortc already decodes on its own; the decoded VideoFrame is stored as is and
+    only converted to BGR at inference size in prepare(), off the event loop.
+    """
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.state = SOURCE_CONNECTING
+        self._task: asyncio.Task | None = None
+
+    def attach(self, track: MediaStreamTrack):
+        if self._task is not None:
+            self._task.cancel()
+        self._task = asyncio.ensure_future(self._pull(track))
+
+    async def _pull(self, track: MediaStreamTrack):
+        try:
+            while True:
+                self.put(await track.recv())
+                self.state = SOURCE_LIVE
+        except MediaStreamError:
+            pass
+        finally:
+            if self.state != SOURCE_STOPPED:
+                self.state = SOURCE_OFFLINE
+
+    def prepare(self, frame: VideoFrame):
+        return video_frame_to_bgr(frame)
+
+    def stop(self):
+        self.state = SOURCE_STOPPED
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+def source_name(url: str | None) -> str:
+    """
+    `url` without user info, query string or fragment, for records that outlive the
+    process: camera and RTMP URLs often carry credentials.
+    """
+    if not url:
+        return ""
+    parts = urlsplit(url)
+    if not parts.netloc:
+        # rtmp:<name>, client:<id>, replay:<path>
+        return url
+    host = parts.hostname or ""
+    if ":" in host:
+        host = f"[{host}]"
+    if parts.port is not None:
+        host = f"{host}:{parts.port}"
+    return urlunsplit((parts.scheme, host, parts.path, "", ""))
+
+
+_readers: dict[str, list] = {}
+
+def attach_source(url: str, source: LatestFrameBuffer):
+    """Registers a source created elsewhere (e.g. a RemoteTrackSource) for acquire_reader."""
+    _readers[url] = [source, 0]
+
+def acquire_reader(url: str | None) -> LatestFrameBuffer:
+    """
+    Returns the shared frame source for `url`, starting it on first use.
+    `rtmp:<publishing_name>` resolves to the buffer fed by the RTMP ingest server,
+    `replay:<path>` to a recorded clip replayed in real time.
+    """
+    entry = _readers.get(url)
+    if entry is None:
+        if url and url.startswith(RTMP_PREFIX):
+            reader = rtmp_stream(url[len(RTMP_PREFIX):])
+        elif url and url.startswith(REPLAY_PREFIX):
+            reader = ClipSource(url[len(REPLAY_PREFIX):], realtime=True, loop=True)
+        else:
+            reader = LatestFrameReader(url)
+        entry = [reader.start(), 0]
+        _readers[url] = entry
+    entry[1] += 1
+    return entry[0]
+
+def register_reader(url: str, reader: LatestFrameBuffer) -> LatestFrameBuffer:
+    """
+    Makes `reader` the shared source for `url`, e.g. a replay paced by its consumer
+    (bench.py). It is started here and stopped by the last release_reader.
+    """
+    if url in _readers:
+        raise ValueError(f"A frame source for {url} is already running")
+    _readers[url] = [reader.start(), 0]
+    return reader
+
+def release_reader(url: str | None):
+    """Drops one reference to the source for `url`; the last one stops its thread."""
+    entry = _readers.get(url)
+    if entry is None:
+        return
+    entry[1] -= 1
+    if entry[1] <= 0:
+        entry[0].stop()
+        _readers.pop(url, None)
+
+def reader_stats() -> list[dict[str, object]]:
+    """Health and frame counters of every source currently in use."""
+    return [{**reader.stats(), "refs": refs} for reader, refs in _readers.values()]
@@ -0,0 +1,29 @@
+"""
+Runs the plan-regression test (tests/test_query_plans.py) against a scratch database.
+
+    PLAN_CHECK_DATABASE_URL=postgres://.../plan_check python check_plans.py [--scale 1]
+
+The test seeds that database the first time and fails if any API query
+sequentially scans a large table.
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import os
+import sys
+import pytest
+
+TEST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "test_query_plans.py")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail if an API query sequentially scans a large table")
+    parser.add_argument("--database-url", default=os.getenv("PLAN_CHECK_DATABASE_URL"))
+    parser.add_argument("--scale", type=int, default=1, help="multiplies the seeded row counts")
+    args = parser.parse_args()
+    if not args.database_url:
+        raise SystemExit("Set PLAN_CHECK_DATABASE_URL to a scratch database")
+    os.environ["PLAN_CHECK_DATABASE_URL"] = args.database_url
+    os.environ["PLAN_CHECK_SCALE"] = str(args.scale)
+    sys.exit(pytest.main(["-q", "-p", "no:cacheprovider", TEST_FILE]))
@@ -1,3 +1,4 @@
+import time
 import cv2
 import faiss
 import torch
@@ -38,19 +39,42 @@ def predict_one_faiss_k1(index, x):
     similarity = 1 / (1 + dist)
     return label, similarity
 
-def detect_faces(frame: cv2.typing.MatLike):
+COLORS = {
+    "ok": (0, 255, 0),
+    "unknown": (0, 255, 255),
+    "spoof": (0, 0, 255),
+}
+
+def _lap(timings: dict[str, float] | None, stage: str, start: float) -> float:
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + (now - start)
+    return now
+
+def analyse_faces(frame: cv2.typing.MatLike, scale: float = 1.0, timings: dict[str, float] | None = None):
     """
-    Detects faces in a given frame, draws bounding boxes, and returns the frame.
+    Runs detection, anti-spoofing and recognition on a frame without touching its pixels.
+    Returns (detections, event): each detection is a dict with "box" [x1, y1, x2, y2],
+    "status" ("ok" | "unknown" | "spoof"), "label", "similarity" and "live_score"
+    (the anti-spoof model's probability that the face is real);
+    event is {"attendee_id", "confidence"} once the last 5 recognitions agree.
+    When `timings` is given, seconds spent per stage (detect, spoof, embed, search)
+    are added to it.
     This is a blocking, CPU-bound function.
     """
-    frame = cv2.resize(frame, None, fx=0.5, fy=0.5)
+    t = time.perf_counter()
+    if scale != 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale)
     img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
     boxes, probs = mtcnn.detect(img)
+    t = _lap(timings, "detect", t)
 
+    detections = []
     if boxes is None:
-        return frame, None
+        return detections, None
 
     h, w, _ = frame.shape
+    similarity = None
     for box, prob in zip(boxes, probs):
         if prob is None or prob < 0.9:
             continue
@@ -81,29 +105,70 @@ def detect_faces(frame: cv2.typing.MatLike):
 
         prediction_spoof = anti_spoof.predict(img_for_anti_spoof, model_path)
         label_spoof = np.argmax(prediction_spoof)
-        color = (0, 255, 0)
-        
+        t = _lap(timings, "spoof", t)
+        det = {
+            "box": [x1, y1, x2, y2],
+            "status": "ok",
+            "label": None,
+            "similarity": None,
+            "live_score": float(prediction_spoof[0][1]),
+        }
+        detections.append(det)
+
         if label_spoof == 1:
             face_pil = Image.fromarray(cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB))
             face_tensor = preprocess(face_pil).unsqueeze(0).to(device)
 
             face_embedding = resnet(face_tensor).detach().cpu().numpy()
+            t = _lap(timings, "embed", t)
             labels, similarity = predict_one_faiss_k1(model, face_embedding)
+            t = _lap(timings, "search", t)
+            det["similarity"] = float(similarity)
 
             if similarity < 0.65:
-                color = (0, 255, 255)
-                cv2.putText(frame, "Unknown", (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
+                det["status"] = "unknown"
             else:
+                det["label"] = int(labels)
                 prediction_queue.append(labels)
         else:
-            color = (0, 0, 255)
-            cv2.putText(frame, "Bad", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
+            det["status"] = "spoof"
 
         if len(prediction_queue) == 5:
             attendee_id = Counter(prediction_queue).most_common(1)[0][0]
             prediction_queue.clear()
-            return frame, {"attendee_id": int(attendee_id), "confidence": similarity}
-
+            return detections, {"attendee_id": int(attendee_id), "confidence": similarity}
+
+    return detections, None
+
+def draw_detections(frame: cv2.typing.MatLike, detections: list[dict]):
+    """Draws boxes and Unknown/Bad labels in place."""
+    for det in detections:
+        x1, y1, x2, y2 = det["box"]
+        color = COLORS[det["status"]]
+        if det["status"] == "unknown":
+            cv2.putText(frame, "Unknown", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
+        elif det["status"] == "spoof":
+            cv2.putText(frame, "Bad", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
         cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+    return frame
 
-    return frame, None
+def detect_faces(frame: cv2.typing.MatLike, scale: float = 1.0, detections: list[dict] | None = None, timings: dict[str, float] | None = None):
+    """
+    Detects faces in a given frame, draws bounding boxes, and returns the annotated copy.
+    Frame sources already deliver frames at inference size; pass `scale` to resize others.
+    The input frame is never modified, since it may be shared by other pipelines.
+    When `detections` is given, the per-face results of analyse_faces are appended to it;
+    `timings` gets the analyse_faces stages plus "draw".
+    This is a blocking, CPU-bound function.
+    """
+    if scale != 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale)
+    else:
+        frame = frame.copy()
+    found, event = analyse_faces(frame, timings=timings)
+    if detections is not None:
+        detections.extend(found)
+    t = time.perf_counter()
+    annotated = draw_detections(frame, found)
+    _lap(timings, "draw", t)
+    return annotated, event
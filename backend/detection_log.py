@@ -0,0 +1,194 @@
+"""
+Append-only log of every face detection, one Arrow IPC stream per session.
+
+    import pyarrow as pa
+    table = pa.ipc.open_stream("data/detections/session_42.1760870000.arrows").read_all()
+
+Needs the optional `pyarrow` dependency (pip install "backend[analytics]"); without
+it detections are not logged.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+DETECTION_LOG_DIR = os.getenv("DETECTION_LOG_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "detections")
+DETECTION_LOG_ENABLED = os.getenv("DETECTION_LOG_ENABLED", "1") != "0"
+FLUSH_SECONDS = 2.0
+BATCH_ROWS = 4096
+IDLE_CLOSE_SECONDS = 120.0
+MAX_PENDING_ROWS = 200_000
+
+COLUMNS = ("ts", "seq", "track", "student_id", "status", "similarity", "live_score", "x1", "y1", "x2", "y2")
+
+def _schema():
+    return pa.schema([
+        ("ts", pa.timestamp("ms", tz="UTC")),
+        ("seq", pa.int64()),
+        ("track", pa.string()),
+        ("student_id", pa.int64()),
+        ("status", pa.string()),
+        ("similarity", pa.float32()),
+        ("live_score", pa.float32()),
+        ("x1", pa.int32()),
+        ("y1", pa.int32()),
+        ("x2", pa.int32()),
+        ("y2", pa.int32()),
+    ])
+
+
+class _SessionFile:
+    def __init__(self, path: str, schema):
+        self.path = path
+        self.sink = pa.OSFile(path, "wb")
+        self.writer = pa.ipc.new_stream(self.sink, schema)
+        self.last_write = time.monotonic()
+
+    def write(self, batch):
+        self.writer.write_batch(batch)
+        self.sink.flush()
+        self.last_write = time.monotonic()
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+class DetectionLog:
+    """
+    Rows are only appended to in-memory column lists on the caller's thread; a
+    background task turns them into record batches and writes them on a worker
+    thread, so logging never waits on the disk. Each session gets one stream file
+    per run, kept open until the session has been idle for a while.
+    """
+    def __init__(self, directory: str, flush_seconds: float = FLUSH_SECONDS, batch_rows: int = BATCH_ROWS):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.batch_rows = batch_rows
+        self.enabled = DETECTION_LOG_ENABLED and pa is not None
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.last_error: str | None = None
+        self._pending: dict[int, dict[str, list[Any]]] = {}
+        self._pending_rows = 0
+        self._files: dict[int, _SessionFile] = {}
+        self._task: asyncio.Task | None = None
+        self._wake: asyncio.Event | None = None
+        self._closing = False
+        self._schema = _schema() if pa is not None else None
+
+    def record(self, session_id: int, track: str, seq: int, detections: list[dict], ts: float | None = None):
+        """`track` names the frame source; pass it without credentials (capture.source_name)."""
+        if not self.enabled or not detections:
+            return
+        if self._pending_rows >= MAX_PENDING_ROWS:
+            # The disk cannot keep up; losing log rows beats growing without bound.
+            self.rows_dropped += len(detections)
+            return
+        cols = self._pending.get(session_id)
+        if cols is None:
+            cols = self._pending[session_id] = {name: [] for name in COLUMNS}
+        ts_ms = int((ts if ts is not None else time.time()) * 1000)
+        for d in detections:
+            x1, y1, x2, y2 = d["box"]
+            cols["ts"].append(ts_ms)
+            cols["seq"].append(seq)
+            cols["track"].append(track)
+            cols["student_id"].append(d["label"] if d["status"] == "ok" else None)
+            cols["status"].append(d["status"])
+            cols["similarity"].append(d["similarity"])
+            cols["live_score"].append(d["live_score"])
+            cols["x1"].append(x1)
+            cols["y1"].append(y1)
+            cols["x2"].append(x2)
+            cols["y2"].append(y2)
+        self._pending_rows += len(detections)
+        if self._pending_rows >= self.batch_rows and self._wake is not None:
+            self._wake.set()
+
+    def start(self):
+        if not self.enabled:
+            if pa is None and DETECTION_LOG_ENABLED:
+                logger.info("pyarrow is not installed; the detection log is disabled")
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            # Let the task finish its current write and flush the rest itself, so
+            # no two threads ever write the same file.
+            self._closing = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        files, self._files = self._files, {}
+        await asyncio.to_thread(lambda: [f.close() for f in files.values()])
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        self._pending_rows = 0
+        if not pending:
+            return
+        try:
+            self.rows_written += await asyncio.to_thread(self._write, pending)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.warning("Writing the detection log failed: %s", e)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+            try:
+                await asyncio.to_thread(self._close_idle)
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning("Closing an idle detection log failed: %s", e)
+        # Rows recorded while the last write was running.
+        await self.flush()
+
+    def _write(self, pending: dict[int, dict[str, list[Any]]]) -> int:
+        rows = 0
+        for session_id, cols in pending.items():
+            f = self._files.get(session_id)
+            if f is None:
+                path = os.path.join(self.directory, f"session_{session_id}.{int(time.time())}.arrows")
+                f = self._files[session_id] = _SessionFile(path, self._schema)
+            batch = pa.record_batch([pa.array(cols[name], type=field.type) for name, field in zip(COLUMNS, self._schema)], schema=self._schema)
+            f.write(batch)
+            rows += batch.num_rows
+        return rows
+
+    def _close_idle(self):
+        now = time.monotonic()
+        for session_id, f in list(self._files.items()):
+            if now - f.last_write > IDLE_CLOSE_SECONDS:
+                f.close()
+                del self._files[session_id]
+
+    def stats(self) -> dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "open_files": len(self._files),
+            "pending_rows": self._pending_rows,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "last_error": self.last_error,
+        }
+
+
+log = DetectionLog(DETECTION_LOG_DIR)
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Topics
+SESSION_EVENT = "session.event"  # a student checked in or out: {session_id, student_id, name, action, time, confidence}
+ATTENDANCE_FLUSHED = "attendance.flushed"  # the write-behind buffer wrote records to the database: {session_ids}
+
+Handler = Callable[[dict], Awaitable[None]]
+
+class EventBus:
+    """
+    In-process publish/subscribe for events produced inside the server (e.g. by the
+    video tracks). Publishing never blocks the caller: each subscriber runs as its
+    own task on the event loop, and a failing subscriber is logged without
+    affecting the others.
+    """
+    def __init__(self):
+        self._handlers: dict[str, list[Handler]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def subscribe(self, topic: str, handler: Handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def unsubscribe(self, topic: str, handler: Handler):
+        handlers = self._handlers.get(topic)
+        if handlers and handler in handlers:
+            handlers.remove(handler)
+
+    def publish(self, topic: str, event: dict) -> bool:
+        """Schedules every subscriber of `topic`; must be called on the event loop thread."""
+        handlers = self._handlers.get(topic)
+        if not handlers:
+            return False
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("Dropped %s event published outside the event loop", topic)
+            return False
+        for handler in list(handlers):
+            task = loop.create_task(self._dispatch(topic, handler, event))
+            # Keep a reference until done; the loop only holds weak references to tasks.
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _dispatch(self, topic: str, handler: Handler, event: dict):
+        try:
+            await handler(event)
+        except Exception:
+            logger.exception("Subscriber %s failed on %s event", getattr(handler, "__name__", handler), topic)
+
+    async def drain(self):
+        """Waits for the subscriber tasks still running, e.g. before shutdown."""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+
+bus = EventBus()
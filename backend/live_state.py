@@ -0,0 +1,75 @@
+from datetime import datetime
+from attendance_buffer import buffer as attendance_buffer
+
+class LiveSession:
+    def __init__(self):
+        self.records: dict[int, dict] = {}
+        self.version = 0
+        self.refs = 0
+
+
+class LiveAttendanceStore:
+    """
+    Attendance of running sessions, kept in memory by the recognition pipelines.
+    The database stays the source of truth: pings, bulk writes, other workers and
+    earlier runs only show up there. The API lays the records the write-behind
+    buffer has not written yet over the database rows, so a check-in is listed
+    at once instead of after the next flush. Only the worker running the
+    session's track has them.
+    """
+    def __init__(self):
+        self._sessions: dict[int, LiveSession] = {}
+
+    def open(self, session_id: int):
+        self._sessions.setdefault(session_id, LiveSession()).refs += 1
+
+    def close(self, session_id: int):
+        live = self._sessions.get(session_id)
+        if live is not None:
+            live.refs -= 1
+            self._discard_if_written(session_id)
+
+    def update(self, session_id: int, student_id: int, name: str | None, in_time: datetime, out_time: datetime | None, confidence: float | None):
+        live = self._sessions.get(session_id)
+        if live is None:
+            return
+        live.records[student_id] = {
+            "student_id": student_id,
+            "name": name,
+            "in_time": in_time,
+            "out_time": out_time,
+            "avg_confidence": confidence,
+        }
+        live.version += 1
+
+    def unsaved(self, session_id: int) -> tuple[list[dict], int] | None:
+        """(records not in the database yet, version), or None when the session is not live here."""
+        live = self._sessions.get(session_id)
+        if live is None:
+            return None
+        if self._discard_if_written(session_id):
+            return None
+        records = [r for student_id, r in live.records.items() if attendance_buffer.is_pending(session_id, student_id)]
+        return records, live.version
+
+    async def on_flushed(self, event: dict):
+        """Bus handler for ATTENDANCE_FLUSHED: frees closed sessions that are fully written now."""
+        for session_id in event["session_ids"]:
+            self._discard_if_written(session_id)
+
+    def _discard_if_written(self, session_id: int) -> bool:
+        """Drops a session no track runs any more once the buffer holds none of its records."""
+        live = self._sessions.get(session_id)
+        if live is None or live.refs > 0 or attendance_buffer.has_pending(session_id):
+            return False
+        del self._sessions[session_id]
+        return True
+
+    def stats(self) -> list[dict[str, object]]:
+        return [
+            {"session_id": session_id, "students": len(live.records), "version": live.version, "tracks": live.refs}
+            for session_id, live in self._sessions.items()
+        ]
+
+
+store = LiveAttendanceStore()
@@ -3,27 +3,64 @@ load_dotenv()
 
 import logging
 import os
+import uuid
 import asyncio
 from datetime import datetime, time, timezone
+from decimal import Decimal
 import json
 import vstrack
-from fastapi import FastAPI, Request, HTTPException, Query
+import capture
+import rtmps
+import events
+import attendance_buffer
+import session_events
+import live_state
+import detection_log
+from cache import read_cache
+from pipelines import PipelineRegistry
+from fastapi import FastAPI, Request, HTTPException, Query, WebSocket, WebSocketDisconnect
 from fastapi.background import BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from aiortc import RTCPeerConnection, RTCSessionDescription
-from starlette.responses import StreamingResponse
+from starlette.responses import JSONResponse, Response, StreamingResponse
+import psycopg
 from psycopg.rows import dict_row
 from psycopg_pool import AsyncConnectionPool
 import models
+import queries
 from contextlib import asynccontextmanager
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+RTMP_PORT = int(os.getenv("RTMP_PORT") or 1935)
+RTMP_ENABLED = os.getenv("RTMP_ENABLED", "1") != "0"
+
 @asynccontextmanager
 async def lifespan(instance: FastAPI):
     await pool.open()
+    events.bus.subscribe(events.SESSION_EVENT, on_session_event)
+    events.bus.subscribe(events.ATTENDANCE_FLUSHED, live_state.store.on_flushed)
+    await attendance_buffer.buffer.start(write_attendance)
+    detection_log.log.start()
+    if session_events.SESSION_EVENTS_NOTIFY:
+        session_events.relay.start(pool, DATABASE_URL)
+    rtmp_server = None
+    if RTMP_ENABLED:
+        try:
+            rtmp_server = await rtmps.start_rtmp_server(port=RTMP_PORT)
+        except OSError as e:
+            # Another worker already owns the port; frames are only ingested there.
+            logger.warning("RTMP server not started on port %s: %s", RTMP_PORT, e)
     yield
+    if rtmp_server is not None:
+        rtmp_server.close()
+    # Stop the tracks first so their last events are published and written out.
+    pipelines.close()
+    await events.bus.drain()
+    await attendance_buffer.buffer.close()
+    await detection_log.log.close()
+    await session_events.relay.close()
     await pool.close()
 
 app = FastAPI(lifespan=lifespan)
@@ -37,7 +74,7 @@ app.add_middleware(
 )
 
 pcs: set[RTCPeerConnection] = set()
-session_event_subs: dict[int, set[asyncio.Queue]] = {}
+pipelines = PipelineRegistry()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 if DATABASE_URL is None:
@@ -64,80 +101,156 @@ async def offer(request: Request):
     end_time_iso = params.get("end_time")
     offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
 
+    # Clients may only pick RTMP streams or their own camera ("client", sent on this
+    # peer connection); other sources come from server configuration.
+    source = params.get("source")
+    remote_source = None
+    if source == "client":
+        source = f"{capture.CLIENT_PREFIX}{uuid.uuid4().hex}"
+        remote_source = capture.RemoteTrackSource(source)
+        capture.attach_source(source, remote_source)
+    elif not (isinstance(source, str) and source.startswith(capture.RTMP_PREFIX) and len(source) > len(capture.RTMP_PREFIX)):
+        source = vstrack.IP_WEBCAM_URL
+    # "client": send plain camera video and detections over the "detections" data channel.
+    annotate = params.get("overlay") != "client"
+    pipeline_key = (source, session_id, annotate)
+
     pc = RTCPeerConnection()
     pcs.add(pc)
 
+    source_track, video_track = pipelines.acquire(
+        pipeline_key,
+        lambda: vstrack.FaceDetectionTrack(students_list, session_id=session_id, end_time_iso=end_time_iso, source=source, annotate=annotate),
+    )
+    # A second viewer of the same session may know about students the first one did not.
+    source_track.students_list.update(students_list)
+    released = False
+
+    @pc.on("track")
+    def on_track(track):
+        if remote_source is not None and track.kind == "video":
+            remote_source.attach(track)
+
+    @pc.on("datachannel")
+    def on_datachannel(channel):
+        if channel.label != "detections":
+            return
+
+        def send(msg: str):
+            if channel.readyState != "open":
+                return
+            # Drop metadata for a slow peer instead of queueing it behind the video.
+            if channel.bufferedAmount > 64 * 1024:
+                return
+            channel.send(msg)
+
+        source_track.metadata_listeners.add(send)
+
+        @channel.on("close")
+        def on_close():
+            source_track.metadata_listeners.discard(send)
+
     @pc.on("connectionstatechange")
     async def on_connectionstatechange():
+        nonlocal released
         print(f"Connection state is {pc.connectionState}")
         if pc.connectionState == "failed" or pc.connectionState == "closed":
+            if not released:
+                released = True
+                pipelines.release(pipeline_key, video_track)
             await pc.close()
             pcs.discard(pc)
             print("Connection closed.")
 
-    video_track = vstrack.FaceDetectionTrack(students_list, session_id=session_id, end_time_iso=end_time_iso)
     pc.addTrack(video_track)
 
-    await pc.setRemoteDescription(offer)
-    answer = await pc.createAnswer()
-    await pc.setLocalDescription(answer)
+    try:
+        await pc.setRemoteDescription(offer)
+        answer = await pc.createAnswer()
+        await pc.setLocalDescription(answer)
+    except Exception:
+        released = True
+        pipelines.release(pipeline_key, video_track)
+        await pc.close()
+        pcs.discard(pc)
+        raise
 
     return { "sdp": pc.localDescription.sdp, "type": pc.localDescription.type }
 
 @app.get("/api/students/search", response_model=list[models.StudentOut])
-async def search_students(query: str = Query(..., min_length=1)):
-    """Search students by id text or name (ILIKE). Returns at most 50 results."""
-    like = f"%{query}%"
+async def search_students(
+    response: Response,
+    query: str = Query(..., min_length=1),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = Query(None, description="X-Next-Cursor of the previous page"),
+):
+    """
+    Search students by id text or name, ignoring case and Vietnamese diacritics, best matches first.
+    Queries of one or two characters only match the start of the id or name.
+    Returns at most `limit` results; when there may be more, X-Next-Cursor holds the cursor of the next page.
+    """
+    after_rank = after_id = None
+    if cursor:
+        try:
+            rank_text, id_text = cursor.split(":", 1)
+            after_rank, after_id = Decimal(rank_text), int(id_text)
+        except (ValueError, ArithmeticError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
             await cur.execute(
-                """
-                SELECT id, name
-                FROM "STUDENTS"
-                WHERE name ILIKE %s OR CAST(id AS TEXT) LIKE %s
-                ORDER BY id
-                LIMIT 50
-                """,
-                (like, like),
+                queries.SEARCH_SQL if len(query) >= queries.SEARCH_TRIGRAM_MIN else queries.SEARCH_PREFIX_SQL,
+                {"query": query, "after_rank": after_rank, "after_id": after_id, "limit": limit},
+                prepare=True,
             )
             rows = await cur.fetchall()
-            return [models.StudentOut(id=row["id"], name=row["name"]) for row in rows]
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = f"{rows[-1]['rank']}:{rows[-1]['id']}"
+    return [models.StudentOut(id=row["id"], name=row["name"]) for row in rows]
+
+def _ping_status(checked_in: bool | None) -> str:
+    if checked_in is None:
+        return "already_checked_out"
+    return "checked_in" if checked_in else "checked_out"
+
+async def _ping(session_id: int, student_ids: list[int]) -> list[dict]:
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(queries.PING_SQL, {"session_id": session_id, "student_ids": student_ids}, prepare=True)
+            rows = await cur.fetchall()
+            await conn.commit()
+    if not rows or not rows[0]["session_exists"]:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return [
+        {"student_id": r["student_id"], "status": _ping_status(r["checked_in"])}
+        for r in rows if r["student_id"] is not None
+    ]
 
 @app.post("/api/sessions/{session_id}/attendance/ping")
 async def attendance_ping(session_id: int, student_id: int):
     """
     Toggle attendance for a student in a given session.
-    - If a row exists with in_time NOT NULL and out_time NULL, set out_time = now (checkout)
-    - Else, insert new row with in_time = now (checkin)
+    - If there is no row yet, insert one with in_time = now (checkin)
+    - If the row has out_time NULL, set out_time = now (checkout)
+    - If the student already checked out, 409; the checkout time is kept
     Returns { status: "checked_in" | "checked_out" }
     """
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT 1 FROM \"SESSIONS\" WHERE id = %s", (session_id,))
-            if await cur.fetchone() is None:
-                raise HTTPException(status_code=404, detail="Session not found")
-
-            await cur.execute(
-                """
-                WITH updated_out AS (
-                    UPDATE "ATTENDANCES"
-                    SET out_time = NOW()
-                    WHERE session_id = %s AND student_id = %s AND out_time IS NULL
-                    RETURNING 1
-                ),
-                ins AS (
-                    INSERT INTO "ATTENDANCES" (session_id, student_id, confidence, in_time, out_time)
-                    SELECT %s, %s, %s, NOW(), NULL
-                    WHERE NOT EXISTS (SELECT 1 FROM updated_out)
-                    RETURNING 1
-                )
-                SELECT CASE WHEN EXISTS (SELECT 1 FROM updated_out) THEN 'checked_out' ELSE 'checked_in' END AS status;
-                """,
-                (session_id, student_id, session_id, student_id, 0.0),
-            )
-            res = await cur.fetchone()
-            await conn.commit()
-            return {"status": res["status"]}
+    results = await _ping(session_id, [student_id])
+    status = results[0]["status"]
+    if status == "already_checked_out":
+        raise HTTPException(status_code=409, detail="Student already checked out of this session")
+    return {"status": status}
+
+@app.post("/api/sessions/{session_id}/attendance/ping/batch")
+async def attendance_ping_batch(session_id: int, payload: models.AttendancePingBatchIn):
+    """
+    Pings many students at once (roll calls, kiosk bursts), same rules as /ping.
+    Returns { results: [{ student_id, status }] } in request order; repeated ids are pinged once.
+    Students who already checked out are reported as "already_checked_out" and left unchanged.
+    """
+    student_ids = list(dict.fromkeys(payload.student_ids))
+    by_id = {r["student_id"]: r for r in await _ping(session_id, student_ids)}
+    return {"results": [by_id[sid] for sid in student_ids if sid in by_id]}
 
 @app.post("/api/classes", response_model=models.ClassOut)
 async def create_class(payload: models.ClassCreate):
@@ -161,6 +274,9 @@ async def create_class(payload: models.ClassCreate):
                 )
 
             await conn.commit()
+            # Counts are cached per account_id, which the payload does not carry.
+            read_cache.invalidate_kind("classes_with_counts")
+            read_cache.invalidate(("class_students", class_id))
             return models.ClassOut(id=class_id, user_id=payload.user_id, name=payload.name, subject=payload.subject, status=payload.status)
 
 @app.get("/api/classes", response_model=list[models.ClassOut])
@@ -168,13 +284,7 @@ async def list_classes(user_id: int = Query(..., description="User ID of the tea
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
             await cur.execute(
-                """
-                SELECT c.id, c.user_id, c.name, c.subject, c.status
-                FROM "CLASSES" c
-                JOIN "USERS" u ON u.id = c.user_id
-                WHERE u.id = %s
-                ORDER BY c.id DESC
-                """,
+                queries.LIST_CLASSES_SQL,
                 (user_id,),
             )
             rows = await cur.fetchall()
@@ -183,76 +293,83 @@ async def list_classes(user_id: int = Query(..., description="User ID of the tea
 
 @app.get("/api/classes/with-counts", response_model=list[models.ClassSummaryOut])
 async def list_classes_with_counts(account_id: str = Query(..., description="User ID of the teacher")):
+    # Rosters and sessions only change through create_class and start_session, which drop
+    # these entries; changes made directly in the database show after READ_CACHE_TTL.
+    key = ("classes_with_counts", account_id)
+    cached = read_cache.get(key)
+    if cached is not None:
+        return cached
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
             await cur.execute(
-                """
-                SELECT c.id, c.user_id, c.name, c.subject, c.status,
-                       COALESCE(sl.cnt, 0) AS roster_count,
-                       COALESCE(se.cnt, 0) AS sessions_count
-                FROM "CLASSES" c
-                JOIN "USERS" u ON u.id = c.user_id AND u.account_id = %s
-                LEFT JOIN (
-                    SELECT class_id, COUNT(*) AS cnt FROM "STUDENT_LIST" GROUP BY class_id
-                ) sl ON sl.class_id = c.id
-                LEFT JOIN (
-                    SELECT class_id, COUNT(*) AS cnt FROM "SESSIONS" GROUP BY class_id
-                ) se ON se.class_id = c.id
-                ORDER BY c.id DESC
-                """,
+                queries.CLASSES_WITH_COUNTS_SQL,
                 (account_id,),
             )
             rows = await cur.fetchall()
-            return [
+            out = [
                 models.ClassSummaryOut(
                     id=r["id"], user_id=r["user_id"], name=r["name"], subject=r["subject"], status=r["status"],
                     roster_count=r["roster_count"], sessions_count=r["sessions_count"]
                 ) for r in rows
             ]
+            read_cache.set(key, out)
+            return out
 
 @app.get("/api/classes/{class_id}", response_model=models.ClassOut)
 async def get_class(class_id: int):
+    key = ("class", class_id)
+    cached = read_cache.get(key)
+    if cached is not None:
+        return cached
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
             await cur.execute(
-                "SELECT id, user_id, name, subject, status FROM \"CLASSES\" WHERE id = %s",
+                queries.GET_CLASS_SQL,
                 (class_id,),
             )
             r = await cur.fetchone()
 
             if not r:
                 raise HTTPException(status_code=404, detail="Class not found")
-            return models.ClassOut(id=r["id"], user_id=r["user_id"], name=r["name"], subject=r["subject"], status=r["status"])
+            out = models.ClassOut(id=r["id"], user_id=r["user_id"], name=r["name"], subject=r["subject"], status=r["status"])
+            read_cache.set(key, out)
+            return out
 
 @app.get("/api/users/{account_id}", response_model=models.UserOut)
 async def get_user_by_account_id(account_id: str):
+    key = ("user", account_id)
+    cached = read_cache.get(key)
+    if cached is not None:
+        return cached
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
             await cur.execute(
-                "SELECT id, account_id, name, faculty, academic_rank FROM \"USERS\" WHERE account_id = %s",
+                queries.GET_USER_SQL,
                 (account_id,),
             )
             r = await cur.fetchone()
             if not r:
                 raise HTTPException(status_code=404, detail="User not found")
-            return models.UserOut(id=r["id"], account_id=r["account_id"], name=r["name"], faculty=r["faculty"], academic_rank=r["academic_rank"])
+            out = models.UserOut(id=r["id"], account_id=r["account_id"], name=r["name"], faculty=r["faculty"], academic_rank=r["academic_rank"])
+            read_cache.set(key, out)
+            return out
 
 @app.get("/api/classes/{class_id}/students", response_model=list[models.StudentOut])
 async def get_class_students(class_id: int):
+    key = ("class_students", class_id)
+    cached = read_cache.get(key)
+    if cached is not None:
+        return cached
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
             await cur.execute(
-                """
-                SELECT s.id, s.name
-                FROM "STUDENT_LIST" sl
-                JOIN "STUDENTS" s ON s.id = sl.student_id
-                WHERE sl.class_id = %s
-                ORDER BY s.name
-                """,
+                queries.CLASS_STUDENTS_SQL,
                 (class_id,),
             )
             rows = await cur.fetchall()
-            return [models.StudentOut(id=r["id"], name=r["name"]) for r in rows]
+            out = [models.StudentOut(id=r["id"], name=r["name"]) for r in rows]
+            read_cache.set(key, out)
+            return out
 
 @app.post("/api/classes/{class_id}/sessions")
 async def start_session(class_id: int, payload: models.SessionStartIn, background: BackgroundTasks):
@@ -282,6 +399,7 @@ async def start_session(class_id: int, payload: models.SessionStartIn, backgroun
             session_id = int(row["id"])
 
             await conn.commit()
+            read_cache.invalidate_kind("classes_with_counts")
             return {"id": session_id, "class_id": class_id, "start_time": start_dt.isoformat(), "end_time": end_dt.isoformat()}
 
 
@@ -290,12 +408,7 @@ async def list_sessions_for_class(class_id: int):
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
             await cur.execute(
-                """
-                SELECT id, class_id, start_time, end_time
-                FROM "SESSIONS"
-                WHERE class_id = %s
-                ORDER BY start_time DESC
-                """,
+                queries.SESSIONS_FOR_CLASS_SQL,
                 (class_id,),
             )
             rows = await cur.fetchall()
@@ -312,14 +425,7 @@ async def list_sessions_with_stats(class_id: int):
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
             await cur.execute(
-                """
-                SELECT s.id, s.class_id, s.start_time, s.end_time,
-                       (SELECT COUNT(*) FROM "ATTENDANCES" a WHERE a.session_id = s.id) AS present_count,
-                       (SELECT COUNT(*) FROM "STUDENT_LIST" sl WHERE sl.class_id = s.class_id) AS total_students
-                FROM "SESSIONS" s
-                WHERE s.class_id = %s
-                ORDER BY s.start_time DESC
-                """,
+                queries.SESSIONS_WITH_STATS_SQL,
                 (class_id,),
             )
             rows = await cur.fetchall()
@@ -339,130 +445,299 @@ async def list_sessions_with_stats(class_id: int):
 
 
 @app.post("/api/sessions/{session_id}/attendance/bulk")
-async def attendance_bulk(session_id: int, payload: list[dict]):
+async def attendance_bulk(session_id: int, request: Request):
     """
     Bulk insert attendance at the end of a session. Payload items: { student_id: int, in_time: ISO, out_time: ISO|null }
+    The body is either a JSON array or, with Content-Type application/x-ndjson, one item per line.
     Times are interpreted as ISO datetimes (with tz); if naive, assumed ICT and converted to UTC for storage.
     Ignores duplicates per (session_id, student_id).
     """
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT 1 FROM \"SESSIONS\" WHERE id = %s", (session_id,))
-            if await cur.fetchone() is None:
-                raise HTTPException(status_code=404, detail="Session not found")
+    if request.headers.get("content-type", "").split(";")[0].strip() == "application/x-ndjson":
+        items = _ndjson_items(request)
+    else:
+        try:
+            payload = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        if not isinstance(payload, list):
+            raise HTTPException(status_code=422, detail="Expected a JSON array")
+        items = _iter_items(payload)
+    return {"inserted": await insert_attendance(session_id, items)}
 
-            params = []
-            for item in payload:
-                sid = int(item["student_id"])
-                it = item.get("in_time")
-                ot = item.get("out_time")
 
-                try:
-                    tin = datetime.fromisoformat(it) if isinstance(it, str) else None
-                except Exception:
-                    tin = None
+async def _iter_items(payload: list):
+    for item in payload:
+        yield item
 
-                try:
-                    tout = datetime.fromisoformat(ot) if isinstance(ot, str) else None
-                except Exception:
-                    tout = None
 
-                conf = item.get("confidence")
-                try:
-                    confv = float(conf) if conf is not None else 0.0
-                except Exception:
-                    confv = 0.0
+async def _ndjson_items(request: Request):
+    buf = b""
+    async for chunk in request.stream():
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _parse_ndjson_line(line)
+    if buf.strip():
+        yield _parse_ndjson_line(buf)
 
-                if tin is None:
-                    continue
-                if tin.tzinfo is None:
-                    tin = tin.replace(tzinfo=LOCAL_TZ)
-                tin = tin.astimezone(timezone.utc)
 
-                if tout is not None:
-                    if tout.tzinfo is None:
-                        tout = tout.replace(tzinfo=LOCAL_TZ)
-                    tout = tout.astimezone(timezone.utc)
-                params.append((session_id, sid, confv, tin, tout, session_id, sid))
+def _parse_ndjson_line(line: bytes) -> dict:
+    try:
+        return json.loads(line)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid NDJSON line")
+
+
+def _attendance_row(item: dict) -> tuple | None:
+    """(student_id, confidence, in_time, out_time) of a bulk item, or None if it has no valid in_time."""
+    if not isinstance(item, dict):
+        # A JSON array or NDJSON line holding a number, list or string.
+        raise TypeError("bulk item is not an object")
+    tin = _to_utc(item.get("in_time"))
+    if tin is None:
+        return None
+    conf = item.get("confidence")
+    try:
+        confv = float(conf) if conf is not None else 0.0
+    except (TypeError, ValueError):
+        confv = 0.0
+    return int(item["student_id"]), confv, tin, _to_utc(item.get("out_time"))
 
-            if params:
-                await cur.executemany(
+
+async def insert_attendance(session_id: int, items) -> int:
+    """
+    Streams `items` into a temp table with COPY as they are parsed, then merges them
+    with one INSERT ... ON CONFLICT against the (session_id, student_id) unique index.
+    That is three statements (CREATE TEMP TABLE, COPY, INSERT) in one transaction.
+    A missing session is a 404 even when no item ends up being inserted.
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                CREATE TEMP TABLE attendance_in (
+                    student_id BIGINT NOT NULL,
+                    confidence DOUBLE PRECISION NOT NULL,
+                    in_time TIMESTAMPTZ NOT NULL,
+                    out_time TIMESTAMPTZ
+                ) ON COMMIT DROP
+                """
+            )
+            async with cur.copy("COPY attendance_in (student_id, confidence, in_time, out_time) FROM STDIN") as copy:
+                async for item in items:
+                    try:
+                        row = _attendance_row(item)
+                    except (KeyError, TypeError, ValueError):
+                        raise HTTPException(status_code=422, detail="Each item must be an object with an integer student_id")
+                    if row is not None:
+                        await copy.write_row(row)
+            try:
+                await cur.execute(
                     """
-                    INSERT INTO "ATTENDANCES" (session_id, student_id, confidence, in_time, out_time)
-                    SELECT %s, %s, %s, %s, %s
-                    WHERE NOT EXISTS (
-                        SELECT 1 FROM "ATTENDANCES" a WHERE a.session_id = %s AND a.student_id = %s
+                    WITH s AS (
+                        SELECT id FROM "SESSIONS" WHERE id = %s
+                    ),
+                    ins AS (
+                        INSERT INTO "ATTENDANCES" (session_id, student_id, confidence, in_time, out_time)
+                        SELECT DISTINCT ON (a.student_id) s.id, a.student_id, a.confidence, a.in_time, a.out_time
+                        FROM attendance_in a CROSS JOIN s
+                        ORDER BY a.student_id, a.in_time
+                        ON CONFLICT (session_id, student_id) DO NOTHING
+                        RETURNING 1
                     )
+                    SELECT EXISTS (SELECT 1 FROM s), (SELECT COUNT(*) FROM ins)
                     """,
-                    params,
+                    (session_id,),
                 )
-                await conn.commit()
-    return {"inserted": len(params) if 'params' in locals() else 0}
-
+                session_exists, inserted = await cur.fetchone()
+            except psycopg.errors.ForeignKeyViolation:
+                # The session was deleted while the items were being copied.
+                session_exists = False
+            if not session_exists:
+                raise HTTPException(status_code=404, detail="Session not found")
+        await conn.commit()
+    return inserted
+
+
+def _attendance_out(r: dict) -> dict:
+    it = r["in_time"].astimezone(LOCAL_TZ) if r["in_time"].tzinfo else r["in_time"].replace(tzinfo=timezone.utc).astimezone(LOCAL_TZ)
+    ot = None
+    if r["out_time"] is not None:
+        ot = r["out_time"].astimezone(LOCAL_TZ) if r["out_time"].tzinfo else r["out_time"].replace(tzinfo=timezone.utc).astimezone(LOCAL_TZ)
+    return {
+        "student_id": r["student_id"],
+        "name": r["name"],
+        "in_time": it.isoformat(),
+        "out_time": ot.isoformat() if ot else None,
+        "avg_confidence": r.get("avg_confidence"),
+    }
 
 @app.get("/api/sessions/{session_id}/attendance")
-async def list_session_attendance(session_id: int):
+async def list_session_attendance(session_id: int, request: Request, since: int | None = Query(None, ge=0)):
+    """
+    Full list: a JSON array with an ETag (304 when unchanged) and the change cursor in X-Attendance-Cursor.
+    While the session runs on this worker, check-ins not yet written to the database are merged in.
+    ?since=<cursor>: { rows, cursor } with the rows inserted or updated since that cursor was issued.
+    A cursor is the oldest transaction still running when it was issued (snapshot xmin), so rows
+    of transactions that commit later are never skipped; rows may repeat and replace earlier ones.
+    """
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
+            if since is not None:
+                # Taken before the rows are read, so nothing committed in between is skipped next time.
+                await cur.execute(queries.ATTENDANCE_CURSOR_SQL)
+                cursor = int((await cur.fetchone())["cursor"])
+                await cur.execute(
+                    queries.ATTENDANCE_SINCE_SQL,
+                    (session_id, str(since)),
+                )
+                rows = await cur.fetchall()
+                return {"rows": [_attendance_out(r) for r in rows], "cursor": cursor}
+
+            # Index-only check first, so an unchanged list costs neither the join nor the transfer.
+            # Every write gives the row a new, larger change_seq, so their sum changes with any update.
             await cur.execute(
-                """
-                SELECT a.student_id, s.name, a.in_time, a.out_time, a.confidence AS avg_confidence
-                FROM "ATTENDANCES" a
-                JOIN "STUDENTS" s ON s.id = a.student_id
-                WHERE a.session_id = %s
-                ORDER BY a.in_time ASC
-                """,
+                queries.ATTENDANCE_HEAD_SQL,
+                (session_id,),
+            )
+            head = await cur.fetchone()
+            live = live_state.store.unsaved(session_id)
+            live_tag = f"-live{live[1]}" if live is not None else ""
+            etag = f'W/"{session_id}-{head["last_seq"]}-{head["seq_sum"]}-{head["n"]}{live_tag}"'
+            headers = {"ETag": etag, "X-Attendance-Cursor": head["cursor"], "Cache-Control": "no-cache"}
+            if etag in (request.headers.get("if-none-match") or ""):
+                return Response(status_code=304, headers=headers)
+
+            await cur.execute(
+                queries.ATTENDANCE_LIST_SQL,
                 (session_id,),
             )
             rows = await cur.fetchall()
-            out = []
-            for r in rows:
-                it = r["in_time"].astimezone(LOCAL_TZ) if r["in_time"].tzinfo else r["in_time"].replace(tzinfo=timezone.utc).astimezone(LOCAL_TZ)
-                ot = None
-                if r["out_time"] is not None:
-                    ot = r["out_time"].astimezone(LOCAL_TZ) if r["out_time"].tzinfo else r["out_time"].replace(tzinfo=timezone.utc).astimezone(LOCAL_TZ)
-                out.append({
-                    "student_id": r["student_id"],
-                    "name": r["name"],
-                    "in_time": it.isoformat(),
-                    "out_time": ot.isoformat() if ot else None,
-                    "avg_confidence": r.get("avg_confidence"),
-                })
-            return out
+            if live is not None and live[0]:
+                # Unsaved records are newer than the student's database row.
+                merged = {r["student_id"]: r for r in rows}
+                merged.update((r["student_id"], r) for r in live[0])
+                rows = sorted(merged.values(), key=lambda r: r["in_time"])
+            return JSONResponse([_attendance_out(r) for r in rows], headers=headers)
 
 async def publish_session_event(session_id: int, event: dict):
-    subs = session_event_subs.get(session_id)
-    if not subs:
-        return
-    for q in list(subs):
-        try:
-            await q.put(event)
-        except Exception:
-            pass
+    await session_events.relay.publish(session_id, event)
 
 
+SSE_HEARTBEAT_SECONDS = 15.0
+
 @app.get("/api/sessions/{session_id}/events")
-async def session_events(session_id: int):
-    queue: asyncio.Queue = asyncio.Queue()
-    session_event_subs.setdefault(session_id, set()).add(queue)
+async def session_events_stream(session_id: int, request: Request, last_event_id: int | None = Query(None)):
+    """
+    Server-sent check-in/out events. Each event carries an id; a reconnecting
+    EventSource sends it back as Last-Event-ID and receives the events it missed.
+    Comment heartbeats keep proxies from timing out and let dead clients be detected.
+    """
+    header = request.headers.get("last-event-id")
+    if header:
+        try:
+            last_event_id = int(header)
+        except ValueError:
+            pass
+    sub = session_events.hub.subscribe(session_id, last_event_id)
 
     async def event_gen():
         try:
+            yield "retry: 3000\n\n"
             while True:
-                evt = await queue.get()
-                yield f"data: {json.dumps(evt)}\n\n"
+                batch = await sub.get(SSE_HEARTBEAT_SECONDS)
+                if not batch:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                yield "".join(f"id: {event_id}\ndata: {json.dumps(evt)}\n\n" for event_id, evt in batch)
         except asyncio.CancelledError:
             pass
         finally:
-            subs = session_event_subs.get(session_id)
-            if subs and queue in subs:
-                subs.discard(queue)
+            session_events.hub.unsubscribe(session_id, sub)
+
+    return StreamingResponse(event_gen(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
-    return StreamingResponse(event_gen(), media_type="text/event-stream")
+
+WS_BATCH_WINDOW = 0.1
+
+@app.websocket("/api/events/ws")
+async def session_events_ws(websocket: WebSocket, format: str = "json"):
+    """
+    Session events of any number of sessions over one socket.
+    Client messages: {"subscribe": [session_id, ...], "last_event_id": {"<session_id>": id}}
+                     {"unsubscribe": [session_id, ...]}
+    Events arriving within WS_BATCH_WINDOW are sent together as {"events": [{id, session_id, ...}]};
+    with ?format=compact as {"e": [[id, session_id, student_id, action, time, name], ...]}.
+    """
+    await websocket.accept()
+    compact = format == "compact"
+    sub = session_events.Subscriber()
+    sessions: set[int] = set()
+
+    async def receive():
+        while True:
+            msg = await websocket.receive_json()
+            if not isinstance(msg, dict):
+                continue
+            last_ids = msg.get("last_event_id") or {}
+            for sid in msg.get("subscribe") or []:
+                try:
+                    sid = int(sid)
+                except (TypeError, ValueError):
+                    continue
+                if sid in sessions:
+                    continue
+                last_id = last_ids.get(str(sid)) if isinstance(last_ids, dict) else None
+                session_events.hub.subscribe(sid, int(last_id) if isinstance(last_id, int) else None, sub)
+                sessions.add(sid)
+            for sid in msg.get("unsubscribe") or []:
+                try:
+                    sid = int(sid)
+                except (TypeError, ValueError):
+                    continue
+                if sid in sessions:
+                    sessions.discard(sid)
+                    session_events.hub.unsubscribe(sid, sub)
+
+    receiver = asyncio.create_task(receive())
+    try:
+        while True:
+            getter = asyncio.ensure_future(sub.get(SSE_HEARTBEAT_SECONDS))
+            await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                # The client went away (or sent something unreadable).
+                getter.cancel()
+                break
+            batch = getter.result()
+            if not batch:
+                continue
+            # Let a burst of check-ins collect into one message.
+            await asyncio.sleep(WS_BATCH_WINDOW)
+            batch += sub.drain()
+            batch = [(event_id, evt) for event_id, evt in batch if evt.get("session_id") in sessions]
+            if not batch:
+                continue
+            if compact:
+                msg = {"e": [[event_id, evt.get("session_id"), evt.get("student_id"), evt.get("action"), evt.get("time"), evt.get("name")] for event_id, evt in batch]}
+            else:
+                msg = {"events": [{"id": event_id, **evt} for event_id, evt in batch]}
+            await websocket.send_text(json.dumps(msg, separators=(",", ":")))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        if receiver.done() and not receiver.cancelled():
+            receiver.exception()
+        for sid in sessions:
+            session_events.hub.unsubscribe(sid, sub)
 
 
 @app.post("/api/sessions/{session_id}/events/notify")
 async def notify_session_event(session_id: int, payload: dict):
+    """For producers outside this process; tracks running here publish on the event bus."""
     evt = {
         "session_id": session_id,
         "student_id": payload.get("student_id"),
@@ -474,11 +749,84 @@ async def notify_session_event(session_id: int, payload: dict):
     return {"ok": True}
 
 
+async def on_session_event(event: dict):
+    evt = {k: event.get(k) for k in ("session_id", "student_id", "name", "action", "time")}
+    await publish_session_event(event["session_id"], evt)
+
+
+def _to_utc(value: str | None) -> datetime | None:
+    if not isinstance(value, str):
+        return None
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=LOCAL_TZ)
+    return dt.astimezone(timezone.utc)
+
+
+async def write_attendance(records: list[dict]):
+    """
+    Writer of the attendance write-behind buffer: saves the latest version of each
+    record, updating out_time/confidence of an existing row or inserting a new one.
+    Records of sessions that no longer exist are skipped.
+    """
+    params = []
+    for r in records:
+        tin = _to_utc(r.get("in_time"))
+        if tin is None:
+            continue
+        conf = r.get("confidence")
+        params.append({
+            "session_id": int(r["session_id"]),
+            "student_id": int(r["student_id"]),
+            "confidence": float(conf) if conf is not None else 0.0,
+            "in_time": tin,
+            "out_time": _to_utc(r.get("out_time")),
+        })
+    if not params:
+        return
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.executemany(
+                queries.WRITE_ATTENDANCE_SQL,
+                params,
+            )
+        await conn.commit()
+
+
+@app.get("/api/pipelines")
+async def list_pipelines():
+    return {
+        "pipelines": pipelines.stats(),
+        "readers": capture.reader_stats(),
+        "attendance": attendance_buffer.buffer.stats(),
+        "session_events": session_events.hub.stats(),
+        "session_event_relay": session_events.relay.stats(),
+        "live_sessions": live_state.store.stats(),
+        "detection_log": detection_log.log.stats(),
+    }
+
+
+@app.get("/api/cache")
+async def cache_stats():
+    """Hit/miss counters of the read-through cache for class, user and roster lookups."""
+    return read_cache.stats()
+
+
+@app.get("/api/sources")
+async def list_sources():
+    """Health of every frame source in use: state, last error, retry countdown and frame counters."""
+    return capture.reader_stats()
+
+
 @app.on_event("shutdown")
 async def on_shutdown():
     coros = [pc.close() for pc in pcs]
     await asyncio.gather(*coros)
     pcs.clear()
+    pipelines.close()
     global pool
     if pool is not None:
         await pool.close()
@@ -0,0 +1,88 @@
+"""
+Applies the SQL files in migrations/ that the database has not seen yet.
+
+    python migrate.py                 # apply pending migrations
+    python migrate.py --status        # list applied and pending versions
+    python migrate.py --baseline 0001 # mark versions up to 0001 as applied without running them
+                                      # (databases created from the old postgres.sql)
+
+Files are named <version>_<description>.sql and run in version order, each in its
+own transaction. Applied versions are recorded in "SCHEMA_MIGRATIONS".
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import os
+import re
+import psycopg
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# Arbitrary key so that two migrate.py runs (e.g. two deploys) never apply migrations concurrently.
+LOCK_ID = 482_193_001
+
+def load_migrations() -> list[tuple[str, str]]:
+    """(version, path) of every migration file, in order."""
+    out = []
+    for name in sorted(os.listdir(MIGRATIONS_DIR)):
+        m = re.match(r"^(\d+)_\w+\.sql$", name)
+        if m:
+            out.append((m.group(1), os.path.join(MIGRATIONS_DIR, name)))
+    return out
+
+def applied_versions(conn: psycopg.Connection) -> set[str]:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS "SCHEMA_MIGRATIONS" (
+            version TEXT PRIMARY KEY,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """
+    )
+    conn.commit()
+    return {row[0] for row in conn.execute('SELECT version FROM "SCHEMA_MIGRATIONS"')}
+
+def migrate(conninfo: str, baseline: str | None = None, status: bool = False) -> int:
+    with psycopg.connect(conninfo) as conn:
+        conn.execute("SELECT pg_advisory_lock(%s)", (LOCK_ID,))
+        try:
+            done = applied_versions(conn)
+            pending = [(v, p) for v, p in load_migrations() if v not in done]
+            if status:
+                for version, path in load_migrations():
+                    print(f"{'applied' if version in done else 'pending'}  {os.path.basename(path)}")
+                return len(pending)
+            for version, path in pending:
+                if baseline is not None and version <= baseline:
+                    conn.execute('INSERT INTO "SCHEMA_MIGRATIONS" (version) VALUES (%s)', (version,))
+                    conn.commit()
+                    print(f"[migrate] Marked {os.path.basename(path)} as applied")
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    sql = f.read()
+                try:
+                    conn.execute(sql)
+                    conn.execute('INSERT INTO "SCHEMA_MIGRATIONS" (version) VALUES (%s)', (version,))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    print(f"[migrate] Failed on {os.path.basename(path)}; nothing of it was applied")
+                    raise
+                print(f"[migrate] Applied {os.path.basename(path)}")
+            if not pending:
+                print("[migrate] Database is up to date")
+            return 0
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (LOCK_ID,))
+            conn.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply database migrations")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--baseline", help="mark versions up to and including this one as applied")
+    parser.add_argument("--status", action="store_true", help="only list applied and pending migrations")
+    args = parser.parse_args()
+    if not args.database_url:
+        raise SystemExit("DATABASE_URL is not set")
+    migrate(args.database_url, baseline=args.baseline, status=args.status)
@@ -1,3 +1,5 @@
+CREATE EXTENSION IF NOT EXISTS vector;
+
 CREATE TABLE "STUDENTS"(
     "id" bigserial PRIMARY KEY NOT NULL,
     "name" VARCHAR(255) NOT NULL
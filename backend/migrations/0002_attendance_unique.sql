@@ -0,0 +1,16 @@
+-- One attendance row per student and session; bulk ingest, pings and the write-behind
+-- buffer merge into it with ON CONFLICT. Pings used to add a row per re-visit, so
+-- duplicated pairs are expected: each is merged into its oldest row (earliest check-in,
+-- latest check-out, best confidence) before the newer rows are deleted.
+UPDATE "ATTENDANCES" a
+SET in_time = m.in_time, out_time = m.out_time, confidence = m.confidence
+FROM (
+    SELECT MIN(id) AS id, MIN(in_time) AS in_time, MAX(out_time) AS out_time, MAX(confidence) AS confidence
+    FROM "ATTENDANCES"
+    GROUP BY session_id, student_id
+    HAVING COUNT(*) > 1
+) m
+WHERE a.id = m.id;
+DELETE FROM "ATTENDANCES" a USING "ATTENDANCES" b
+WHERE a.session_id = b.session_id AND a.student_id = b.student_id AND a.id > b.id;
+CREATE UNIQUE INDEX "attendances_session_student_unique" ON "ATTENDANCES"("session_id", "student_id");
@@ -0,0 +1,22 @@
+-- Change tracking for incremental attendance sync.
+-- change_seq takes the next sequence value on every insert and update, so it changes
+-- whenever the row does; it feeds the ETag of the full list. It is not a cursor:
+-- values are taken in write order, not commit order, and a row whose transaction
+-- commits after a later one would fall behind a client's "change_seq > <cursor>".
+-- change_xid is the transaction that last wrote the row. A cursor is the xmin of the
+-- reader's snapshot: every transaction below it had finished, so "change_xid >= <cursor>"
+-- returns every row the client has not seen, plus possibly a few it has.
+CREATE SEQUENCE "attendances_change_seq";
+ALTER TABLE "ATTENDANCES"
+    ADD COLUMN "change_seq" BIGINT NOT NULL DEFAULT nextval('attendances_change_seq'),
+    ADD COLUMN "change_xid" XID8 NOT NULL DEFAULT pg_current_xact_id();
+CREATE FUNCTION attendances_bump_change_seq() RETURNS trigger AS $$
+BEGIN
+    NEW.change_seq := nextval('attendances_change_seq');
+    NEW.change_xid := pg_current_xact_id();
+    RETURN NEW;
+END $$ LANGUAGE plpgsql;
+CREATE TRIGGER "attendances_change_seq" BEFORE UPDATE ON "ATTENDANCES"
+    FOR EACH ROW EXECUTE FUNCTION attendances_bump_change_seq();
+CREATE INDEX "attendances_session_change_seq" ON "ATTENDANCES"("session_id", "change_seq");
+CREATE INDEX "attendances_session_change_xid" ON "ATTENDANCES"("session_id", "change_xid");
@@ -0,0 +1,14 @@
+-- Student search: accent- and case-insensitive substring matching backed by trigram indexes.
+-- unaccent() is only STABLE, so an IMMUTABLE wrapper is needed for the generated column.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+CREATE FUNCTION f_unaccent(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;
+ALTER TABLE "STUDENTS" ADD COLUMN "search_name" TEXT GENERATED ALWAYS AS (lower(f_unaccent("name"))) STORED;
+CREATE INDEX "students_search_name_trgm" ON "STUDENTS" USING gin ("search_name" gin_trgm_ops);
+CREATE INDEX "students_id_text_trgm" ON "STUDENTS" USING gin ((CAST("id" AS TEXT)) gin_trgm_ops);
+-- Queries of one or two characters contain no trigram; they match as prefixes through
+-- btree range scans instead.
+CREATE INDEX "students_search_name_prefix" ON "STUDENTS" ("search_name" text_pattern_ops);
+CREATE INDEX "students_id_text_prefix" ON "STUDENTS" ((CAST("id" AS TEXT)) text_pattern_ops);
@@ -0,0 +1,6 @@
+-- Secondary indexes for the filters every handler in main.py uses.
+-- ATTENDANCES(session_id, student_id) is covered by attendances_session_student_unique.
+CREATE INDEX "sessions_class_id_start_time" ON "SESSIONS"("class_id", "start_time" DESC);
+CREATE INDEX "student_list_class_id" ON "STUDENT_LIST"("class_id");
+CREATE INDEX "classes_user_id" ON "CLASSES"("user_id");
+CREATE INDEX "student_identities_student_id" ON "STUDENT_IDENTITIES"("student_id");
@@ -0,0 +1,159 @@
+-- Counters read by the dashboard lists instead of aggregating STUDENT_LIST, SESSIONS and
+-- ATTENDANCES on every call. Statement-level triggers apply one aggregated change per
+-- statement; a missing counter row means zero. Decrements only UPDATE, so cascading
+-- deletes of the parent (whose counter row goes too) are harmless. Updates that move
+-- rows to another class or session, and TRUNCATE, are covered as well.
+-- A statement that inserts attendance updates its session's counter row, so concurrent
+-- writers of one session queue on that row lock until they commit.
+CREATE TABLE "CLASS_COUNTERS"(
+    "class_id" BIGINT PRIMARY KEY NOT NULL REFERENCES "CLASSES"("id") ON DELETE CASCADE,
+    "roster_count" BIGINT NOT NULL DEFAULT 0,
+    "sessions_count" BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE "SESSION_COUNTERS"(
+    "session_id" BIGINT PRIMARY KEY NOT NULL REFERENCES "SESSIONS"("id") ON DELETE CASCADE,
+    "present_count" BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE FUNCTION student_list_counters_ins() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO "CLASS_COUNTERS" (class_id, roster_count)
+    SELECT class_id, COUNT(*) FROM new_rows GROUP BY class_id
+    ON CONFLICT (class_id) DO UPDATE SET roster_count = "CLASS_COUNTERS".roster_count + EXCLUDED.roster_count;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE FUNCTION student_list_counters_del() RETURNS trigger AS $$
+BEGIN
+    UPDATE "CLASS_COUNTERS" c SET roster_count = c.roster_count - d.n
+    FROM (SELECT class_id, COUNT(*) AS n FROM old_rows GROUP BY class_id) d
+    WHERE c.class_id = d.class_id;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE FUNCTION sessions_counters_ins() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO "CLASS_COUNTERS" (class_id, sessions_count)
+    SELECT class_id, COUNT(*) FROM new_rows GROUP BY class_id
+    ON CONFLICT (class_id) DO UPDATE SET sessions_count = "CLASS_COUNTERS".sessions_count + EXCLUDED.sessions_count;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE FUNCTION sessions_counters_del() RETURNS trigger AS $$
+BEGIN
+    UPDATE "CLASS_COUNTERS" c SET sessions_count = c.sessions_count - d.n
+    FROM (SELECT class_id, COUNT(*) AS n FROM old_rows GROUP BY class_id) d
+    WHERE c.class_id = d.class_id;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE FUNCTION attendances_counters_ins() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO "SESSION_COUNTERS" (session_id, present_count)
+    SELECT session_id, COUNT(*) FROM new_rows GROUP BY session_id
+    ON CONFLICT (session_id) DO UPDATE SET present_count = "SESSION_COUNTERS".present_count + EXCLUDED.present_count;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE FUNCTION attendances_counters_del() RETURNS trigger AS $$
+BEGIN
+    UPDATE "SESSION_COUNTERS" c SET present_count = c.present_count - d.n
+    FROM (SELECT session_id, COUNT(*) AS n FROM old_rows GROUP BY session_id) d
+    WHERE c.session_id = d.session_id;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+-- Updates: net change per parent, counting new rows up and old rows down. Only rows
+-- whose class/session changed leave a non-zero total, so ordinary updates (checkouts,
+-- confidence) touch no counter row.
+CREATE FUNCTION student_list_counters_upd() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO "CLASS_COUNTERS" (class_id, roster_count)
+    SELECT class_id, SUM(n) FROM (
+        SELECT class_id, 1 AS n FROM new_rows
+        UNION ALL
+        SELECT class_id, -1 FROM old_rows
+    ) d GROUP BY class_id HAVING SUM(n) <> 0
+    ON CONFLICT (class_id) DO UPDATE SET roster_count = "CLASS_COUNTERS".roster_count + EXCLUDED.roster_count;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE FUNCTION sessions_counters_upd() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO "CLASS_COUNTERS" (class_id, sessions_count)
+    SELECT class_id, SUM(n) FROM (
+        SELECT class_id, 1 AS n FROM new_rows
+        UNION ALL
+        SELECT class_id, -1 FROM old_rows
+    ) d GROUP BY class_id HAVING SUM(n) <> 0
+    ON CONFLICT (class_id) DO UPDATE SET sessions_count = "CLASS_COUNTERS".sessions_count + EXCLUDED.sessions_count;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE FUNCTION attendances_counters_upd() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO "SESSION_COUNTERS" (session_id, present_count)
+    SELECT session_id, SUM(n) FROM (
+        SELECT session_id, 1 AS n FROM new_rows
+        UNION ALL
+        SELECT session_id, -1 FROM old_rows
+    ) d GROUP BY session_id HAVING SUM(n) <> 0
+    ON CONFLICT (session_id) DO UPDATE SET present_count = "SESSION_COUNTERS".present_count + EXCLUDED.present_count;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE FUNCTION student_list_counters_truncate() RETURNS trigger AS $$
+BEGIN
+    UPDATE "CLASS_COUNTERS" SET roster_count = 0 WHERE roster_count <> 0;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE FUNCTION sessions_counters_truncate() RETURNS trigger AS $$
+BEGIN
+    UPDATE "CLASS_COUNTERS" SET sessions_count = 0 WHERE sessions_count <> 0;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE FUNCTION attendances_counters_truncate() RETURNS trigger AS $$
+BEGIN
+    UPDATE "SESSION_COUNTERS" SET present_count = 0 WHERE present_count <> 0;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+-- Transition tables allow only one event per trigger, hence separate INSERT/UPDATE/DELETE
+-- triggers; they also rule out column lists, so the UPDATE triggers fire on any update.
+CREATE TRIGGER "student_list_counters_ins" AFTER INSERT ON "STUDENT_LIST"
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION student_list_counters_ins();
+CREATE TRIGGER "student_list_counters_del" AFTER DELETE ON "STUDENT_LIST"
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION student_list_counters_del();
+CREATE TRIGGER "sessions_counters_ins" AFTER INSERT ON "SESSIONS"
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION sessions_counters_ins();
+CREATE TRIGGER "sessions_counters_del" AFTER DELETE ON "SESSIONS"
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION sessions_counters_del();
+CREATE TRIGGER "attendances_counters_ins" AFTER INSERT ON "ATTENDANCES"
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION attendances_counters_ins();
+CREATE TRIGGER "attendances_counters_del" AFTER DELETE ON "ATTENDANCES"
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION attendances_counters_del();
+CREATE TRIGGER "student_list_counters_upd" AFTER UPDATE ON "STUDENT_LIST"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION student_list_counters_upd();
+CREATE TRIGGER "sessions_counters_upd" AFTER UPDATE ON "SESSIONS"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION sessions_counters_upd();
+CREATE TRIGGER "attendances_counters_upd" AFTER UPDATE ON "ATTENDANCES"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION attendances_counters_upd();
+CREATE TRIGGER "student_list_counters_truncate" AFTER TRUNCATE ON "STUDENT_LIST"
+    FOR EACH STATEMENT EXECUTE FUNCTION student_list_counters_truncate();
+CREATE TRIGGER "sessions_counters_truncate" AFTER TRUNCATE ON "SESSIONS"
+    FOR EACH STATEMENT EXECUTE FUNCTION sessions_counters_truncate();
+CREATE TRIGGER "attendances_counters_truncate" AFTER TRUNCATE ON "ATTENDANCES"
+    FOR EACH STATEMENT EXECUTE FUNCTION attendances_counters_truncate();
+
+-- Backfill from the existing rows.
+INSERT INTO "CLASS_COUNTERS" (class_id, roster_count, sessions_count)
+SELECT c.id,
+       (SELECT COUNT(*) FROM "STUDENT_LIST" sl WHERE sl.class_id = c.id),
+       (SELECT COUNT(*) FROM "SESSIONS" s WHERE s.class_id = c.id)
+FROM "CLASSES" c;
+
+INSERT INTO "SESSION_COUNTERS" (session_id, present_count)
+SELECT session_id, COUNT(*) FROM "ATTENDANCES" GROUP BY session_id;
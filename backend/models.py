@@ -45,3 +45,6 @@ class SessionOut(BaseModel):
     class_id: int
     start_time: datetime
     end_time: datetime
+
+class AttendancePingBatchIn(BaseModel):
+    student_ids: list[int] = Field(min_length=1, max_length=5000)
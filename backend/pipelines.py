@@ -0,0 +1,50 @@
+from typing import Callable
+from aiortc import MediaStreamTrack
+from aiortc.contrib.media import MediaRelay
+
+class SourcePipeline:
+    def __init__(self, key: tuple, track: MediaStreamTrack):
+        self.key = key
+        self.track = track
+        self.refs = 0
+
+class PipelineRegistry:
+    """
+    Keeps one analysed track per (source, session) and fans its frames out to every
+    subscribed peer connection through a MediaRelay. Capture and inference happen
+    once no matter how many viewers are attached; the track is stopped when the
+    last viewer releases it.
+    """
+    def __init__(self):
+        self.relay = MediaRelay()
+        self._pipelines: dict[tuple, SourcePipeline] = {}
+
+    def acquire(self, key: tuple, factory: Callable[[], MediaStreamTrack]) -> tuple[MediaStreamTrack, MediaStreamTrack]:
+        """Returns (source track, per-viewer relay proxy), creating the pipeline if needed."""
+        pipeline = self._pipelines.get(key)
+        if pipeline is None or pipeline.track.readyState == "ended":
+            pipeline = SourcePipeline(key, factory())
+            self._pipelines[key] = pipeline
+            print(f"[pipeline] Started {key}")
+        pipeline.refs += 1
+        return pipeline.track, self.relay.subscribe(pipeline.track)
+
+    def release(self, key: tuple, proxy: MediaStreamTrack | None = None):
+        if proxy is not None:
+            proxy.stop()
+        pipeline = self._pipelines.get(key)
+        if pipeline is None:
+            return
+        pipeline.refs -= 1
+        if pipeline.refs <= 0:
+            self._pipelines.pop(key, None)
+            pipeline.track.stop()
+            print(f"[pipeline] Stopped {key}")
+
+    def stats(self) -> list[dict[str, object]]:
+        return [{"key": list(p.key), "viewers": p.refs} for p in self._pipelines.values()]
+
+    def close(self):
+        for pipeline in list(self._pipelines.values()):
+            pipeline.track.stop()
+        self._pipelines.clear()
@@ -0,0 +1,161 @@
+"""
+SQL of the API handlers in main.py. tests/test_query_plans.py EXPLAINs these same
+strings, so a handler's query cannot change without the plan check seeing it.
+"""
+
+# Accent- and case-insensitive substring match on the trigram-indexed search_name
+# (and id text), ranked: exact id, then name prefix, then trigram similarity.
+# Keyset pagination continues after (rank, id) of the previous page's last row.
+SEARCH_SQL = """
+WITH q AS (
+    SELECT e.q, '%%' || e.esc || '%%' AS pat, e.esc || '%%' AS prefix
+    FROM (
+        SELECT t.q, replace(replace(replace(t.q, '\\', '\\\\'), '%%', '\\%%'), '_', '\\_') AS esc
+        FROM (SELECT lower(f_unaccent(%(query)s)) AS q) t
+    ) e
+)
+SELECT id, name, rank FROM (
+    SELECT s.id, s.name,
+           round((
+               2 * (CAST(s.id AS TEXT) = q.q)::int
+               + (s.search_name LIKE q.prefix)::int
+               + similarity(s.search_name, q.q)
+           )::numeric, 6) AS rank
+    FROM "STUDENTS" s, q
+    WHERE s.search_name LIKE q.pat OR CAST(s.id AS TEXT) LIKE q.pat
+) m
+WHERE %(after_rank)s::numeric IS NULL OR (m.rank, -m.id) < (%(after_rank)s::numeric, -%(after_id)s::bigint)
+ORDER BY m.rank DESC, m.id ASC
+LIMIT %(limit)s
+"""
+
+# Queries shorter than this have no trigram for the GIN indexes to look up.
+SEARCH_TRIGRAM_MIN = 3
+
+# Short queries: id text or name starting with the query, as btree range scans
+# (a LIKE pattern built at run time cannot use the prefix optimisation). chr(1114111)
+# sorts after every character, so [q, q || chr(1114111)) is exactly the prefix range.
+SEARCH_PREFIX_SQL = """
+WITH q AS (
+    SELECT lower(f_unaccent(%(query)s)) AS q
+)
+SELECT id, name, rank FROM (
+    SELECT s.id, s.name,
+           (2 * (CAST(s.id AS TEXT) = q.q)::int + (s.search_name = q.q)::int)::numeric AS rank
+    FROM "STUDENTS" s, q
+    WHERE (s.search_name ~>=~ q.q AND s.search_name ~<~ q.q || chr(1114111))
+       OR (CAST(s.id AS TEXT) ~>=~ q.q AND CAST(s.id AS TEXT) ~<~ q.q || chr(1114111))
+) m
+WHERE %(after_rank)s::numeric IS NULL OR (m.rank, -m.id) < (%(after_rank)s::numeric, -%(after_id)s::bigint)
+ORDER BY m.rank DESC, m.id ASC
+LIMIT %(limit)s
+"""
+
+# Pings the students in `unnest(%(student_ids)s)` for one session, in one statement: a
+# missing session makes the insert select nothing and session_exists false.
+# One row per (session, student): the first ping checks in, the second checks out. A
+# checked-out row is left alone, so its checkout time is kept; its checked_in is NULL.
+PING_SQL = """
+WITH s AS (
+    SELECT id FROM "SESSIONS" WHERE id = %(session_id)s
+),
+u AS (
+    SELECT student_id FROM unnest(%(student_ids)s::bigint[]) AS u(student_id)
+),
+up AS (
+    INSERT INTO "ATTENDANCES" (session_id, student_id, confidence, in_time, out_time)
+    SELECT s.id, u.student_id, 0.0, NOW(), NULL
+    FROM s CROSS JOIN u
+    ON CONFLICT (session_id, student_id) DO UPDATE
+    SET out_time = NOW()
+    WHERE "ATTENDANCES".out_time IS NULL
+    RETURNING student_id, out_time IS NULL AS checked_in
+)
+SELECT EXISTS (SELECT 1 FROM s) AS session_exists, u.student_id, up.checked_in
+FROM (SELECT 1) AS one
+LEFT JOIN u ON EXISTS (SELECT 1 FROM s)
+LEFT JOIN up ON up.student_id = u.student_id
+"""
+
+LIST_CLASSES_SQL = """
+SELECT c.id, c.user_id, c.name, c.subject, c.status
+FROM "CLASSES" c
+JOIN "USERS" u ON u.id = c.user_id
+WHERE u.id = %s
+ORDER BY c.id DESC
+"""
+
+CLASSES_WITH_COUNTS_SQL = """
+SELECT c.id, c.user_id, c.name, c.subject, c.status,
+       COALESCE(cc.roster_count, 0) AS roster_count,
+       COALESCE(cc.sessions_count, 0) AS sessions_count
+FROM "CLASSES" c
+JOIN "USERS" u ON u.id = c.user_id AND u.account_id = %s
+LEFT JOIN "CLASS_COUNTERS" cc ON cc.class_id = c.id
+ORDER BY c.id DESC
+"""
+
+GET_CLASS_SQL = 'SELECT id, user_id, name, subject, status FROM "CLASSES" WHERE id = %s'
+
+GET_USER_SQL = 'SELECT id, account_id, name, faculty, academic_rank FROM "USERS" WHERE account_id = %s'
+
+CLASS_STUDENTS_SQL = """
+SELECT s.id, s.name
+FROM "STUDENT_LIST" sl
+JOIN "STUDENTS" s ON s.id = sl.student_id
+WHERE sl.class_id = %s
+ORDER BY s.name
+"""
+
+SESSIONS_FOR_CLASS_SQL = """
+SELECT id, class_id, start_time, end_time
+FROM "SESSIONS"
+WHERE class_id = %s
+ORDER BY start_time DESC
+"""
+
+SESSIONS_WITH_STATS_SQL = """
+SELECT s.id, s.class_id, s.start_time, s.end_time,
+       COALESCE(sc.present_count, 0) AS present_count,
+       COALESCE(cc.roster_count, 0) AS total_students
+FROM "SESSIONS" s
+LEFT JOIN "SESSION_COUNTERS" sc ON sc.session_id = s.id
+LEFT JOIN "CLASS_COUNTERS" cc ON cc.class_id = s.class_id
+WHERE s.class_id = %s
+ORDER BY s.start_time DESC
+"""
+
+# Change cursor of the attendance list; see migrations/0003_attendance_change_seq.sql.
+ATTENDANCE_CURSOR_SQL = "SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS cursor"
+
+# Index-only: decides the ETag (and 304) before the list is read.
+ATTENDANCE_HEAD_SQL = """
+SELECT COALESCE(MAX(change_seq), 0) AS last_seq, COALESCE(SUM(change_seq), 0) AS seq_sum, COUNT(*) AS n,
+       pg_snapshot_xmin(pg_current_snapshot())::text AS cursor
+FROM "ATTENDANCES" WHERE session_id = %s
+"""
+
+ATTENDANCE_LIST_SQL = """
+SELECT a.student_id, s.name, a.in_time, a.out_time, a.confidence AS avg_confidence
+FROM "ATTENDANCES" a
+JOIN "STUDENTS" s ON s.id = a.student_id
+WHERE a.session_id = %s
+ORDER BY a.in_time ASC
+"""
+
+ATTENDANCE_SINCE_SQL = """
+SELECT a.student_id, s.name, a.in_time, a.out_time, a.confidence AS avg_confidence
+FROM "ATTENDANCES" a
+JOIN "STUDENTS" s ON s.id = a.student_id
+WHERE a.session_id = %s AND a.change_xid >= %s::text::xid8
+ORDER BY a.change_seq ASC
+"""
+
+# Writer of the attendance write-behind buffer; executed once per record.
+WRITE_ATTENDANCE_SQL = """
+INSERT INTO "ATTENDANCES" (session_id, student_id, confidence, in_time, out_time)
+SELECT %(session_id)s, %(student_id)s, %(confidence)s, %(in_time)s, %(out_time)s::timestamptz
+WHERE EXISTS (SELECT 1 FROM "SESSIONS" WHERE id = %(session_id)s)
+ON CONFLICT (session_id, student_id) DO UPDATE
+SET out_time = COALESCE(EXCLUDED.out_time, "ATTENDANCES".out_time), confidence = EXCLUDED.confidence
+"""
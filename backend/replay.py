@@ -0,0 +1,156 @@
+"""
+Record a live camera to a compressed clip and replay it as a frame source.
+
+    python replay.py record http://<camera>/video clips/room101.mkv --seconds 120
+
+Clips keep the capture timestamps (millisecond pts). Set IP_WEBCAM_URL to
+"replay:clips/room101.mkv" to serve a clip in place of the camera, or use
+bench.py to run the pipeline on it as fast as possible.
+"""
+import argparse
+import threading
+import time
+from fractions import Fraction
+import av
+import cv2
+import numpy as np
+from shared import LatestFrameBuffer, SOURCE_LIVE, SOURCE_OFFLINE, SOURCE_STOPPED, video_frame_to_bgr
+
+REPLAY_PREFIX = "replay:"
+CLIP_TIME_BASE = Fraction(1, 1000)
+
+class ClipSource(LatestFrameBuffer):
+    """
+    Replays a recorded clip on a background thread, storing decoded av.VideoFrames.
+    realtime=True paces frames by their recorded timestamps and, like a camera,
+    overwrites frames nobody read. realtime=False delivers every frame exactly once,
+    waiting for the consumer, so a run is deterministic and as fast as the pipeline.
+    """
+    def __init__(self, path: str, realtime: bool = True, loop: bool = True):
+        # Stale-frame expiry makes no sense when the consumer sets the pace.
+        super().__init__(f"{REPLAY_PREFIX}{path}", max_age=2.0 if realtime else float("inf"))
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.finished = threading.Event()
+        self.decode_seconds = 0.0
+        self.frames_decoded = 0
+        self._read_seq = 0
+        self._consumed = threading.Event()
+        self._consumed.set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"replay:{path}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._consumed.set()
+        self.state = SOURCE_STOPPED
+
+    def read(self):
+        frame, seq = super().read()
+        if frame is not None and seq != self._read_seq:
+            self._read_seq = seq
+            self._consumed.set()
+        return frame, seq
+
+    def prepare(self, frame) -> np.ndarray:
+        return video_frame_to_bgr(frame)
+
+    def _run(self):
+        self.state = SOURCE_LIVE
+        try:
+            while not self._stop.is_set():
+                self._play_once()
+                if not self.loop:
+                    break
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"[replay] Error replaying {self.path}: {e}")
+        finally:
+            if self.state != SOURCE_STOPPED:
+                self.state = SOURCE_OFFLINE
+            self.finished.set()
+
+    def _play_once(self):
+        with av.open(self.path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            start_wall = time.monotonic()
+            start_pts = None
+            decoder = container.decode(stream)
+            while not self._stop.is_set():
+                t = time.perf_counter()
+                frame = next(decoder, None)
+                if frame is None:
+                    return
+                self.decode_seconds += time.perf_counter() - t
+                self.frames_decoded += 1
+
+                if self.realtime:
+                    ts = frame.time or 0.0
+                    if start_pts is None:
+                        start_pts = ts
+                    delay = (ts - start_pts) - (time.monotonic() - start_wall)
+                    if delay > 0:
+                        self._stop.wait(delay)
+                else:
+                    self._consumed.wait()
+                    self._consumed.clear()
+                self.put(frame)
+
+
+def record(url: str, path: str, seconds: float, crf: int = 23):
+    """Captures `url` at full resolution into `path` with millisecond timestamps."""
+    cap = cv2.VideoCapture(url)
+    if not cap.isOpened():
+        raise SystemExit(f"Could not open video stream: {url}")
+
+    container = av.open(path, "w")
+    stream = None
+    start = time.monotonic()
+    frames = 0
+    try:
+        while time.monotonic() - start < seconds:
+            ret, img = cap.read()
+            if not ret:
+                print("[replay] Could not read frame, stopping.")
+                break
+            if stream is None:
+                h, w = img.shape[:2]
+                stream = container.add_stream("libx264", rate=30)
+                stream.width = w & ~1
+                stream.height = h & ~1
+                stream.pix_fmt = "yuv420p"
+                stream.time_base = CLIP_TIME_BASE
+                stream.codec_context.time_base = CLIP_TIME_BASE
+                stream.options = {"crf": str(crf), "preset": "veryfast"}
+            frame = av.VideoFrame.from_ndarray(img[:stream.height, :stream.width], format="bgr24")
+            frame.pts = int((time.monotonic() - start) * 1000)
+            frame.time_base = CLIP_TIME_BASE
+            for packet in stream.encode(frame):
+                container.mux(packet)
+            frames += 1
+        if stream is not None:
+            for packet in stream.encode():
+                container.mux(packet)
+    finally:
+        container.close()
+        cap.release()
+    print(f"[replay] Recorded {frames} frames in {time.monotonic() - start:.1f}s to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record a camera to a clip for replay")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    rec = sub.add_parser("record")
+    rec.add_argument("url")
+    rec.add_argument("path")
+    rec.add_argument("--seconds", type=float, default=60.0)
+    rec.add_argument("--crf", type=int, default=23)
+    args = parser.parse_args()
+    if args.cmd == "record":
+        record(args.url, args.path, args.seconds, args.crf)
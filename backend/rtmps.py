@@ -1,4 +1,7 @@
 import asyncio
+import os
+import queue
+import threading
 import av
 from pyrtmp import StreamClosedException
 from pyrtmp.messages.audio import AudioMessage
@@ -7,19 +10,158 @@ from pyrtmp.messages.data import MetaDataMessage
 from pyrtmp.messages.video import VideoMessage
 from pyrtmp.session_manager import SessionManager
 from pyrtmp.rtmp import SimpleRTMPController, RTMPProtocol, SimpleRTMPServer
-from shared import frame_queue
+from shared import LatestFrameBuffer, RtmpStreamBuffer, rtmp_stream
+
+RTMP_KEYFRAME_ONLY = os.getenv("RTMP_KEYFRAME_ONLY", "0") == "1"
+
+# FLV video tag header: frame type in the high nibble, codec id in the low one.
+FLV_KEYFRAME = 1
+FLV_DISPOSABLE_INTER = 3
+FLV_CODEC_AVC = 7
+AVC_SEQUENCE_HEADER = 0
+AVC_NALU = 1
+
+def _is_reference(data: bytes, length_size: int) -> bool:
+    """True if any slice NAL unit in an AVCC access unit has nal_ref_idc != 0."""
+    pos = 0
+    n = len(data)
+    while pos + length_size <= n:
+        size = int.from_bytes(data[pos:pos + length_size], "big")
+        pos += length_size
+        if size <= 0 or pos >= n:
+            break
+        header = data[pos]
+        if header & 0x1F in (1, 5) and (header >> 5) & 0x03:
+            return True
+        pos += size
+    return False
+
+
+class H264Decoder:
+    """
+    Decodes one RTMP stream on a dedicated thread with PyAV frame/slice threading.
+    Packets that cannot produce a frame anyone will see are skipped before decode:
+    non-reference frames while the output buffer still holds an unread frame, every
+    inter frame in keyframe-only mode, and everything up to the next keyframe after
+    the packet queue overflowed.
+    """
+    def __init__(self, buffer: LatestFrameBuffer, keyframe_only: bool = False, max_pending: int = 8):
+        self.buffer = buffer
+        self.keyframe_only = keyframe_only
+        self.packets_decoded = 0
+        self.packets_skipped = 0
+        self.length_size = 4
+        self._extradata: bytes | None = None
+        self._need_keyframe = True
+        self._closed = False
+        self._config: bytes | None = None
+        self._config_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._codec = None
+        self._thread = threading.Thread(target=self._run, name=f"rtmp-decode:{buffer.name}", daemon=True)
+        self._thread.start()
+
+    def _open_codec(self):
+        codec = av.CodecContext.create("h264", "r")
+        codec.thread_type = "AUTO"
+        codec.thread_count = 0
+        if self._extradata:
+            codec.extradata = self._extradata
+        return codec
+
+    def set_config(self, record: bytes):
+        """
+        Stores the AVCDecoderConfigurationRecord from the FLV sequence header.
+        It is kept outside the packet queue so a full queue can never drop it:
+        without SPS/PPS nothing after it decodes.
+        """
+        if len(record) >= 5:
+            self.length_size = (record[4] & 0x03) + 1
+        with self._config_lock:
+            self._config = bytes(record)
+        # Wakes an idle thread; a busy one applies the record before its next packet.
+        self._submit(("config",))
+
+    def submit(self, data: bytes, keyframe: bool, reference: bool):
+        """Called from the event loop; never blocks."""
+        if self.keyframe_only and not keyframe:
+            self.packets_skipped += 1
+            return
+        if self._need_keyframe and not keyframe:
+            self.packets_skipped += 1
+            return
+        self._need_keyframe = False
+        if not self._submit(("packet", data, keyframe, reference)):
+            self.packets_skipped += 1
+            if reference:
+                # Losing a reference frame corrupts everything until the next IDR.
+                self._need_keyframe = True
+
+    def _submit(self, item) -> bool:
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        self._closed = True
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            # The thread checks _closed after the packet it is working on.
+            pass
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None or self._closed:
+                break
+            try:
+                with self._config_lock:
+                    config, self._config = self._config, None
+                if config is not None:
+                    self._extradata = config
+                    if self._codec is not None:
+                        self._codec.close()
+                    self._codec = self._open_codec()
+                if item[0] == "config":
+                    continue
+
+                _, data, keyframe, reference = item
+                if self._codec is None:
+                    self._codec = self._open_codec()
+                if not reference and self.buffer.saturated():
+                    self.packets_skipped += 1
+                    continue
+                for frame in self._codec.decode(av.Packet(data)):
+                    # Stored as decoded: passthrough viewers get it as is, and
+                    # only processed frames are converted (RtmpStreamBuffer.prepare).
+                    self.buffer.put(frame)
+                self.packets_decoded += 1
+            except Exception as e:
+                print(f"[rtmp] Error decoding video frame: {e}")
+        if self._codec is not None:
+            try:
+                self._codec.close()
+            except Exception:
+                pass
+
 
 class StreamController(SimpleRTMPController):
     def __init__(self):
         super().__init__()
-        self.codec_context = None
+        self.decoder: H264Decoder | None = None
+        self.buffer: RtmpStreamBuffer | None = None
 
     async def on_ns_publish(self, session: SessionManager, message: NSPublish) -> None:
-        # print(f"[rtmp] Publishing stream: {message.publishing_name}")
+        print(f"[rtmp] Publishing stream: {message.publishing_name}")
+        self.buffer = rtmp_stream(message.publishing_name)
+        self.buffer.publish()
         try:
-            self.codec_context = av.CodecContext.create("h264", "r")
+            self.decoder = H264Decoder(self.buffer, keyframe_only=RTMP_KEYFRAME_ONLY)
         except Exception as e:
-            print(f"[rtmp] Error creating codec context: {e}")
+            print(f"[rtmp] Error creating decoder: {e}")
         await super().on_ns_publish(session, message)
 
     async def on_metadata(self, session: SessionManager, message: MetaDataMessage) -> None:
@@ -27,34 +169,33 @@ class StreamController(SimpleRTMPController):
         await super().on_metadata(session, message)
 
     async def on_video_message(self, session: SessionManager, message: VideoMessage) -> None:
-        if not self.codec_context:
+        if self.decoder is None:
             return
 
-        try:
-            packets = self.codec_context.parse(message.payload)
-            for packet in packets:
-                if packet.is_corrupt:
-                    continue
-                frames = self.codec_context.decode(packet)
-                for frame in frames:
-                    if frame:
-                        img = frame.to_ndarray(format="bgr24")
-                        if not frame_queue.full():
-                            frame_queue.put_nowait(img)
-                        else:
-                            # print("[rtmp] Frame queue is full, dropping frame.")
-                            pass
-        except Exception as e:
-            # print(f"[rtmp] Error decoding video frame: {e}")
-            pass
+        payload = message.payload
+        if len(payload) < 5 or (payload[0] & 0x0F) != FLV_CODEC_AVC:
+            return
+        frame_type = payload[0] >> 4
+        packet_type = payload[1]
+        if packet_type == AVC_SEQUENCE_HEADER:
+            self.decoder.set_config(payload[5:])
+        elif packet_type == AVC_NALU:
+            data = bytes(payload[5:])
+            keyframe = frame_type == FLV_KEYFRAME
+            reference = keyframe or (frame_type != FLV_DISPOSABLE_INTER and _is_reference(data, self.decoder.length_size))
+            self.decoder.submit(data, keyframe, reference)
 
     async def on_audio_message(self, session: SessionManager, message: AudioMessage) -> None:
         pass
 
     async def on_stream_closed(self, session: SessionManager, exception: StreamClosedException) -> None:
         print("[rtmp] Stream closed.")
-        if self.codec_context:
-            self.codec_context.close()
+        if self.decoder is not None:
+            self.decoder.close()
+            self.decoder = None
+        if self.buffer is not None:
+            self.buffer.unpublish()
+            self.buffer = None
         await super().on_stream_closed(session, exception)
 
 
@@ -71,6 +212,11 @@ class RTMPServer(SimpleRTMPServer):
         )
         print(f"[rtmp] Server listening on {host}:{port}")
 
-async def start_rtmp_server():
+    def close(self):
+        if getattr(self, "server", None) is not None:
+            self.server.close()
+
+async def start_rtmp_server(host: str = "0.0.0.0", port: int = 1935) -> RTMPServer:
     server = RTMPServer()
-    await server.run()
+    await server.run(host, port)
+    return server
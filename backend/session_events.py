@@ -0,0 +1,249 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import OrderedDict, deque
+import psycopg
+
+logger = logging.getLogger(__name__)
+
+SESSION_RING_SIZE = 256          # events kept per session for Last-Event-ID replay
+SUBSCRIBER_BUFFER = 64           # undelivered events kept per subscriber
+CHANNEL_IDLE_TTL = 3600.0        # seconds a session without subscribers or events keeps its ring
+NOTIFY_CHANNEL = "session_events"
+NOTIFY_MAX_PAYLOAD = 7900        # Postgres rejects NOTIFY payloads from 8000 bytes
+SESSION_EVENTS_NOTIFY = os.getenv("SESSION_EVENTS_NOTIFY", "1") != "0"
+
+_last_id = 0
+
+def next_event_id() -> int:
+    """
+    Microsecond timestamp, strictly increasing within the process. Ids only label
+    events: relayed events reach the hubs in NOTIFY order, which is the same on
+    every worker but not necessarily id order, so replay goes by ring position.
+    """
+    global _last_id
+    _last_id = max(_last_id + 1, int(time.time() * 1_000_000))
+    return _last_id
+
+class Subscriber:
+    """
+    Bounded outbox of one SSE or WebSocket connection, which may follow several
+    sessions. A newer event for the same student replaces the one still waiting;
+    beyond `maxlen` pending events the oldest is dropped.
+    """
+    def __init__(self, maxlen: int = SUBSCRIBER_BUFFER):
+        self.maxlen = maxlen
+        self.dropped = 0
+        self._pending: OrderedDict[object, tuple[int, dict]] = OrderedDict()
+        self._ready = asyncio.Event()
+
+    def push(self, event_id: int, event: dict):
+        key = (event.get("session_id"), event.get("student_id"))
+        if key[1] is None:
+            key = ("id", event_id)
+        elif key in self._pending:
+            # Only the student's latest state matters to a lagging viewer.
+            del self._pending[key]
+            self.dropped += 1
+        self._pending[key] = (event_id, event)
+        while len(self._pending) > self.maxlen:
+            self._pending.popitem(last=False)
+            self.dropped += 1
+        self._ready.set()
+
+    async def get(self, timeout: float) -> list[tuple[int, dict]]:
+        """Pending events in arrival order; an empty list if none arrived within `timeout`."""
+        if not self._pending:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        return self.drain()
+
+    def drain(self) -> list[tuple[int, dict]]:
+        """Pending events in arrival order, without waiting."""
+        self._ready.clear()
+        batch = list(self._pending.values())
+        self._pending.clear()
+        return batch
+
+
+class SessionChannel:
+    def __init__(self, ring_size: int):
+        self.last_id = 0
+        self.ring: deque[tuple[int, dict]] = deque(maxlen=ring_size)
+        self.subscribers: set[Subscriber] = set()
+        self.last_active = time.monotonic()
+
+
+class SessionEventHub:
+    """
+    Fans session events (check-ins/outs) out to SSE subscribers. Publishing never
+    waits on a subscriber; each session keeps a ring of recent events in arrival
+    order so a reconnecting EventSource resumes after its Last-Event-ID.
+    """
+    def __init__(self, ring_size: int = SESSION_RING_SIZE, idle_ttl: float = CHANNEL_IDLE_TTL):
+        self.ring_size = ring_size
+        self.idle_ttl = idle_ttl
+        self._channels: dict[int, SessionChannel] = {}
+
+    def _channel(self, session_id: int) -> SessionChannel:
+        channel = self._channels.get(session_id)
+        if channel is None:
+            self._sweep()
+            channel = SessionChannel(self.ring_size)
+            self._channels[session_id] = channel
+        channel.last_active = time.monotonic()
+        return channel
+
+    def _sweep(self):
+        now = time.monotonic()
+        for session_id, channel in list(self._channels.items()):
+            if not channel.subscribers and now - channel.last_active > self.idle_ttl:
+                del self._channels[session_id]
+
+    def publish(self, session_id: int, event: dict, event_id: int | None = None) -> int:
+        """Delivers `event` to this process's subscribers; `event_id` is set when it came from another worker."""
+        channel = self._channel(session_id)
+        if event_id is None:
+            event_id = next_event_id()
+        channel.last_id = max(channel.last_id, event_id)
+        channel.ring.append((event_id, event))
+        for sub in channel.subscribers:
+            sub.push(event_id, event)
+        return event_id
+
+    def subscribe(self, session_id: int, last_event_id: int | None = None, sub: Subscriber | None = None) -> Subscriber:
+        """Registers a (new or given) subscriber, queueing the ring's events after `last_event_id`."""
+        channel = self._channel(session_id)
+        if sub is None:
+            sub = Subscriber()
+        if last_event_id is not None:
+            for event_id, event in self._missed(channel, last_event_id):
+                sub.push(event_id, event)
+        channel.subscribers.add(sub)
+        return sub
+
+    @staticmethod
+    def _missed(channel: SessionChannel, last_event_id: int) -> list[tuple[int, dict]]:
+        """
+        Events that arrived after `last_event_id`. Ids from different workers are not
+        ordered by arrival, so this goes by position; an id that has already left the
+        ring (or was never seen here) falls back to comparing ids.
+        """
+        events = list(channel.ring)
+        for pos in range(len(events) - 1, -1, -1):
+            if events[pos][0] == last_event_id:
+                return events[pos + 1:]
+        return [item for item in events if item[0] > last_event_id]
+
+    def unsubscribe(self, session_id: int, sub: Subscriber):
+        channel = self._channels.get(session_id)
+        if channel is not None:
+            channel.subscribers.discard(sub)
+            channel.last_active = time.monotonic()
+
+    def stats(self) -> list[dict[str, object]]:
+        return [
+            {
+                "session_id": session_id,
+                "subscribers": len(channel.subscribers),
+                "buffered": len(channel.ring),
+                "last_id": channel.last_id,
+                "dropped": sum(sub.dropped for sub in channel.subscribers),
+            }
+            for session_id, channel in self._channels.items()
+        ]
+
+
+class NotifyRelay:
+    """
+    Carries session events between API workers through Postgres LISTEN/NOTIFY.
+    Every worker keeps one listening connection and hands what it receives to its
+    local hub, including its own events, so all workers see the same ids in the
+    same order. Without a listener (disabled, or the database unreachable) events
+    are delivered locally only.
+    """
+    def __init__(self, hub: SessionEventHub, channel: str = NOTIFY_CHANNEL):
+        self.hub = hub
+        self.channel = channel
+        self.listening = False
+        self.received = 0
+        self.last_error: str | None = None
+        self._pool = None
+        self._conninfo: str | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self, pool, conninfo: str):
+        self._pool = pool
+        self._conninfo = conninfo
+        self._task = asyncio.create_task(self._listen())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.listening = False
+
+    async def publish(self, session_id: int, event: dict):
+        event_id = next_event_id()
+        if self.listening:
+            payload = json.dumps({"s": session_id, "i": event_id, "e": event}, separators=(",", ":"))
+            if len(payload.encode()) <= NOTIFY_MAX_PAYLOAD:
+                try:
+                    async with self._pool.connection() as conn:
+                        await conn.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+                        await conn.commit()
+                    return
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.warning("NOTIFY failed, delivering session event locally: %s", e)
+        self.hub.publish(session_id, event, event_id)
+
+    async def _listen(self):
+        failures = 0
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self._conninfo, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {self.channel}")
+                    self.listening = True
+                    failures = 0
+                    logger.info("Listening for session events on %s", self.channel)
+                    async for notify in conn.notifies():
+                        self._deliver(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning("Session event listener disconnected: %s", e)
+            finally:
+                self.listening = False
+            failures += 1
+            await asyncio.sleep(random.uniform(0.5, 1.0) * min(30.0, 2 ** min(failures, 5)))
+
+    def _deliver(self, payload: str):
+        try:
+            msg = json.loads(payload)
+            self.hub.publish(int(msg["s"]), msg["e"], int(msg["i"]))
+            self.received += 1
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("Ignoring malformed session event notification: %s", e)
+
+    def stats(self) -> dict[str, object]:
+        return {
+            "channel": self.channel,
+            "listening": self.listening,
+            "received": self.received,
+            "last_error": self.last_error,
+        }
+
+
+hub = SessionEventHub()
+relay = NotifyRelay(hub)
@@ -1,4 +1,153 @@
-import asyncio
+import os
+import threading
+import time
+import numpy as np
 
-# Shared queue for video frames
-frame_queue: asyncio.Queue = asyncio.Queue(maxsize=30)
+# Frames are handed to detect_faces at this width (0: half of the source width).
+INFERENCE_WIDTH = int(os.getenv("INFERENCE_WIDTH") or 0)
+INFERENCE_SCALE = 0.5
+
+def inference_size(width: int, height: int) -> tuple[int, int]:
+    """Target (width, height) for a source frame; even sizes keep yuv420p happy."""
+    if INFERENCE_WIDTH:
+        scale = min(1.0, INFERENCE_WIDTH / width)
+    else:
+        scale = INFERENCE_SCALE
+    return max(2, int(width * scale) & ~1), max(2, int(height * scale) & ~1)
+
+def video_frame_to_bgr(frame) -> np.ndarray:
+    """
+    BGR image at inference size of a decoded av.VideoFrame. libswscale scales and
+    converts in one pass, so no full-resolution BGR frame is allocated.
+    """
+    width, height = inference_size(frame.width, frame.height)
+    return frame.reformat(width=width, height=height, format="bgr24").to_ndarray()
+
+# Source health states
+SOURCE_CONNECTING = "connecting"
+SOURCE_LIVE = "live"
+SOURCE_RECONNECTING = "reconnecting"
+SOURCE_OFFLINE = "offline"
+SOURCE_STOPPED = "stopped"
+
+class LatestFrameBuffer:
+    """
+    Single-slot frame buffer: producers overwrite, consumers always get the newest frame.
+    Frames that are overwritten before anyone reads them are counted as dropped.
+    Producers store frames as cheaply as they can; prepare() turns the one a
+    consumer actually processes into a BGR image at inference size.
+    """
+    def __init__(self, name: str | None, max_age: float = 2.0):
+        self.name = name
+        self.max_age = max_age
+        self.state = SOURCE_OFFLINE
+        self.last_error: str | None = None
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self._lock = threading.Lock()
+        self._frame: np.ndarray | None = None
+        self._frame_ts = 0.0
+        self._seq = 0
+        self._consumed_seq = 0
+
+    def put(self, frame: np.ndarray):
+        with self._lock:
+            if self._seq > self._consumed_seq:
+                self.frames_dropped += 1
+            self._frame = frame
+            self._frame_ts = time.monotonic()
+            self._seq += 1
+            self.frames_read += 1
+
+    def read(self) -> tuple[np.ndarray | None, int]:
+        """
+        Returns the latest frame and its sequence number without blocking.
+        The frame is None until the first frame arrives or when it is older than `max_age`.
+        """
+        with self._lock:
+            if self._frame is None or (time.monotonic() - self._frame_ts) > self.max_age:
+                return None, self._seq
+            self._consumed_seq = self._seq
+            return self._frame, self._seq
+
+    def prepare(self, frame) -> np.ndarray:
+        """
+        BGR image at inference size of a frame returned by read(). Blocking:
+        consumers call it off the event loop, once per frame they process.
+        """
+        return frame
+
+    def saturated(self) -> bool:
+        """True when the newest frame has not been consumed yet."""
+        with self._lock:
+            return self._seq > self._consumed_seq
+
+    @property
+    def connected(self) -> bool:
+        return self.state == SOURCE_LIVE
+
+    def stats(self) -> dict[str, object]:
+        with self._lock:
+            age = (time.monotonic() - self._frame_ts) if self._frame is not None else None
+            return {
+                "url": self.name,
+                "state": self.state,
+                "last_error": self.last_error,
+                "frame_age": round(age, 3) if age is not None else None,
+                "frames_read": self.frames_read,
+                "frames_dropped": self.frames_dropped,
+            }
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+
+class RtmpStreamBuffer(LatestFrameBuffer):
+    """
+    Latest decoded av.VideoFrame of one RTMP publishing_name. The buffer is
+    forgotten once its publisher has disconnected and no reader holds it, so
+    publish/unpublish cycles do not accumulate buffers.
+    """
+    def __init__(self, stream: str):
+        super().__init__(f"rtmp:{stream}")
+        self.stream = stream
+        self.publishing = False
+        self.reading = False
+
+    def prepare(self, frame) -> np.ndarray:
+        return video_frame_to_bgr(frame)
+
+    def start(self):
+        self.reading = True
+        return self
+
+    def stop(self):
+        self.reading = False
+        self._forget()
+
+    def publish(self):
+        self.publishing = True
+        self.state = SOURCE_LIVE
+
+    def unpublish(self):
+        self.publishing = False
+        self.state = SOURCE_OFFLINE
+        self._forget()
+
+    def _forget(self):
+        if not self.publishing and not self.reading and rtmp_streams.get(self.stream) is self:
+            del rtmp_streams[self.stream]
+
+
+# One latest-frame buffer per RTMP publishing_name that is published or read
+rtmp_streams: dict[str, RtmpStreamBuffer] = {}
+
+def rtmp_stream(name: str) -> RtmpStreamBuffer:
+    buffer = rtmp_streams.get(name)
+    if buffer is None:
+        buffer = RtmpStreamBuffer(name)
+        rtmp_streams[name] = buffer
+    return buffer
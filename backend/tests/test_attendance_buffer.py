@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+from attendance_buffer import WriteBehindBuffer
+
+
+def record(student_id: int, in_time: str = "2025-01-01T08:00:00+00:00", out_time: str | None = None) -> dict:
+    return {"session_id": 7, "student_id": student_id, "in_time": in_time, "out_time": out_time, "confidence": 0.9}
+
+
+def write_log(path, lines: list[str]):
+    path.write_text("".join(lines), encoding="utf-8")
+
+
+def entry(seq: int, r: dict) -> str:
+    return json.dumps({"seq": seq, "r": r}) + "\n"
+
+
+class FakeWriter:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.batches: list[list[dict]] = []
+
+    async def __call__(self, records: list[dict]):
+        if self.fail:
+            raise RuntimeError("database down")
+        self.batches.append(records)
+
+
+def test_replay_skips_flushed_entries(tmp_path):
+    log = tmp_path / "attendance.log"
+    write_log(log, [
+        entry(1, record(1)),
+        entry(2, record(2)),
+        json.dumps({"flushed": 2}) + "\n",
+        entry(3, record(3)),
+    ])
+    buf = WriteBehindBuffer(str(log))
+    assert buf._replay() is False
+    assert not buf.is_pending(7, 1)
+    assert not buf.is_pending(7, 2)
+    assert buf.is_pending(7, 3)
+    assert buf._seq == 3
+
+
+def test_replay_keeps_latest_version_and_skips_torn_line(tmp_path):
+    log = tmp_path / "attendance.log"
+    write_log(log, [
+        entry(1, record(1)),
+        entry(2, record(1, out_time="2025-01-01T09:00:00+00:00")),
+        '{"seq": 3, "r": {"session_id": 7, "stud',
+    ])
+    buf = WriteBehindBuffer(str(log))
+    assert buf._replay() is True
+    assert buf._dirty[(7, 1)] == (2, record(1, out_time="2025-01-01T09:00:00+00:00"))
+    assert len(buf._dirty) == 1
+
+
+def test_flush_writes_pending_and_replays_nothing_afterwards(tmp_path):
+    log = tmp_path / "attendance.log"
+
+    async def run():
+        writer = FakeWriter()
+        buf = WriteBehindBuffer(str(log), interval=60)
+        await buf.start(writer)
+        buf.put(record(1))
+        buf.put(record(2))
+        buf.put(record(1, out_time="2025-01-01T09:00:00+00:00"))
+        assert buf.is_pending(7, 1) and buf.has_pending(7)
+        await buf.close()
+        return writer
+
+    writer = asyncio.run(run())
+    assert [[r["student_id"] for r in batch] for batch in writer.batches] == [[2, 1]]
+    assert writer.batches[0][1]["out_time"] == "2025-01-01T09:00:00+00:00"
+    fresh = WriteBehindBuffer(str(log))
+    fresh._replay()
+    assert not fresh.has_pending(7)
+
+
+def test_failed_flush_keeps_records_for_replay(tmp_path):
+    log = tmp_path / "attendance.log"
+
+    async def run():
+        buf = WriteBehindBuffer(str(log), interval=60)
+        await buf.start(FakeWriter(fail=True))
+        buf.put(record(1))
+        await buf.close()
+        return buf
+
+    buf = asyncio.run(run())
+    assert buf.last_error == "database down"
+    fresh = WriteBehindBuffer(str(log))
+    fresh._replay()
+    assert fresh.is_pending(7, 1)
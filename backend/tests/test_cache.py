@@ -0,0 +1,59 @@
+import cache
+from cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_cache(monkeypatch, maxsize: int = 3, ttl: float = 10.0) -> tuple[TTLCache, Clock]:
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return TTLCache(maxsize=maxsize, ttl=ttl), clock
+
+
+def test_get_returns_value_until_ttl(monkeypatch):
+    c, clock = make_cache(monkeypatch)
+    c.set(("class", 1), "A")
+    clock.now += 9.9
+    assert c.get(("class", 1)) == "A"
+    clock.now += 0.2
+    assert c.get(("class", 1), "gone") == "gone"
+    assert c.stats()["entries"] == 0
+    assert (c.hits, c.misses) == (1, 1)
+
+
+def test_evicts_least_recently_used(monkeypatch):
+    c, _ = make_cache(monkeypatch)
+    for i in range(3):
+        c.set(("class", i), i)
+    c.get(("class", 0))
+    c.set(("class", 3), 3)
+    assert c.get(("class", 1)) is None
+    assert [c.get(("class", i)) for i in (0, 2, 3)] == [0, 2, 3]
+
+
+def test_set_refreshes_expiry(monkeypatch):
+    c, clock = make_cache(monkeypatch)
+    c.set(("user", "a"), 1)
+    clock.now += 8
+    c.set(("user", "a"), 2)
+    clock.now += 8
+    assert c.get(("user", "a")) == 2
+
+
+def test_invalidate_kind_only_drops_that_kind(monkeypatch):
+    c, _ = make_cache(monkeypatch, maxsize=10)
+    c.set(("class", 1), "A")
+    c.set(("class", 2), "B")
+    c.set(("roster", 1), [1, 2])
+    c.invalidate_kind("class")
+    assert c.get(("class", 1)) is None
+    assert c.get(("class", 2)) is None
+    assert c.get(("roster", 1)) == [1, 2]
+    c.invalidate(("roster", 1))
+    assert c.get(("roster", 1)) is None
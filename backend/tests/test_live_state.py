@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime, timezone
+
+import events
+import live_state
+from attendance_buffer import WriteBehindBuffer
+from live_state import LiveAttendanceStore
+
+IN_TIME = datetime(2025, 1, 1, 8, tzinfo=timezone.utc)
+
+
+class Writer:
+    async def __call__(self, records: list[dict]):
+        pass
+
+
+def put(buf: WriteBehindBuffer, store: LiveAttendanceStore, student_id: int):
+    buf.put({"session_id": 7, "student_id": student_id, "in_time": IN_TIME.isoformat(), "out_time": None, "confidence": 0.9})
+    store.update(7, student_id, f"Student {student_id}", IN_TIME, None, 0.9)
+
+
+def test_close_frees_a_fully_written_session(tmp_path, monkeypatch):
+    buf = WriteBehindBuffer(str(tmp_path / "attendance.log"))
+    monkeypatch.setattr(live_state, "attendance_buffer", buf)
+    store = LiveAttendanceStore()
+    store.open(7)
+    store.close(7)
+    assert store.stats() == []
+
+
+def test_flush_frees_a_closed_session_without_a_read(tmp_path, monkeypatch):
+    buf = WriteBehindBuffer(str(tmp_path / "attendance.log"))
+    monkeypatch.setattr(live_state, "attendance_buffer", buf)
+    bus = events.EventBus()
+    monkeypatch.setattr("attendance_buffer.bus", bus)
+    store = LiveAttendanceStore()
+    bus.subscribe(events.ATTENDANCE_FLUSHED, store.on_flushed)
+
+    async def run():
+        await buf.start(Writer())
+        store.open(7)
+        put(buf, store, 1)
+        assert store.unsaved(7)[0][0]["student_id"] == 1
+        store.close(7)
+        assert len(store.stats()) == 1
+        await buf.close()
+        await bus.drain()
+
+    asyncio.run(run())
+    assert store.stats() == []
+
+
+def test_unsaved_only_lists_pending_records(tmp_path, monkeypatch):
+    buf = WriteBehindBuffer(str(tmp_path / "attendance.log"))
+    monkeypatch.setattr(live_state, "attendance_buffer", buf)
+    store = LiveAttendanceStore()
+    store.open(7)
+    put(buf, store, 1)
+    store.update(7, 2, "Student 2", IN_TIME, None, 0.8)
+    records, version = store.unsaved(7)
+    assert [r["student_id"] for r in records] == [1]
+    assert version == 2
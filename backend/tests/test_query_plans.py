@@ -0,0 +1,120 @@
+"""
+Plan-regression test: EXPLAINs the queries of the API handlers against a seeded
+database and fails if any of them sequentially scans a large table.
+
+    PLAN_CHECK_DATABASE_URL=postgres://.../plan_check python -m pytest tests/test_query_plans.py
+
+Point it at an empty scratch database: the fixtures apply the migrations, seed it
+with classroom-shaped data the first time (PLAN_CHECK_SCALE multiplies the row
+counts) and run ANALYZE. Queries are planned with representative parameter
+values; they come from queries.py, the same strings the handlers in main.py run.
+Skipped when PLAN_CHECK_DATABASE_URL is not set. check_plans.py runs it from the
+command line.
+"""
+import os
+from datetime import datetime, timezone
+import pytest
+
+DATABASE_URL = os.getenv("PLAN_CHECK_DATABASE_URL")
+if not DATABASE_URL:
+    pytest.skip("PLAN_CHECK_DATABASE_URL is not set", allow_module_level=True)
+
+psycopg = pytest.importorskip("psycopg")
+import queries
+from migrate import migrate
+
+SCALE = int(os.getenv("PLAN_CHECK_SCALE") or 1)
+MIN_ROWS = 10_000   # a sequential scan of a smaller table is fine
+
+SEED_SQL = """
+INSERT INTO "USERS" (account_id, name, faculty, academic_rank)
+SELECT 'acct_' || i, 'Teacher ' || i, 'CS', 'Lecturer' FROM generate_series(1, 1000 * {scale}) i;
+
+INSERT INTO "STUDENTS" (name)
+SELECT (ARRAY['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Võ', 'Đặng'])[1 + i % 7]
+       || ' ' || (ARRAY['Văn', 'Thị', 'Minh', 'Đức', 'Ngọc'])[1 + i % 5]
+       || ' ' || (ARRAY['An', 'Bình', 'Cường', 'Dũng', 'Hà', 'Hùng', 'Linh', 'Trang'])[1 + i % 8]
+       || ' ' || i
+FROM generate_series(1, 200000 * {scale}) i;
+
+INSERT INTO "CLASSES" (user_id, name, subject)
+SELECT 1 + i % (1000 * {scale}), 'Class ' || i, 'Subject ' || (i % 40)
+FROM generate_series(1, 5000 * {scale}) i;
+
+INSERT INTO "STUDENT_LIST" (student_id, class_id)
+SELECT DISTINCT 1 + (c * 7919 + k * 104729) % (200000 * {scale}), c
+FROM generate_series(1, 5000 * {scale}) c, generate_series(1, 50) k;
+
+INSERT INTO "SESSIONS" (class_id, start_time, end_time)
+SELECT c, NOW() - k * INTERVAL '1 day', NOW() - k * INTERVAL '1 day' + INTERVAL '90 minutes'
+FROM generate_series(1, 5000 * {scale}) c, generate_series(1, 20) k;
+
+INSERT INTO "ATTENDANCES" (session_id, student_id, confidence, in_time)
+SELECT s.id, sl.student_id, 0.9, s.start_time
+FROM "SESSIONS" s JOIN "STUDENT_LIST" sl ON sl.class_id = s.class_id
+WHERE s.id % 4 = 0;
+
+INSERT INTO "STUDENT_IDENTITIES" (student_id, vector)
+SELECT i, array_fill(0.0::real, ARRAY[512])::vector FROM generate_series(1, 20000 * {scale}) i;
+"""
+
+# (handler, query, params): the query strings main.py executes
+QUERIES = [
+    ("search_students", queries.SEARCH_SQL, {"query": "dũng 1234", "after_rank": None, "after_id": None, "limit": 50}),
+    ("search_students (short)", queries.SEARCH_PREFIX_SQL, {"query": "hà", "after_rank": None, "after_id": None, "limit": 50}),
+    ("attendance_ping", queries.PING_SQL, {"session_id": 4000, "student_ids": [12345, 23456]}),
+    ("list_classes", queries.LIST_CLASSES_SQL, (500,)),
+    ("list_classes_with_counts", queries.CLASSES_WITH_COUNTS_SQL, ("acct_500",)),
+    ("get_class", queries.GET_CLASS_SQL, (2500,)),
+    ("get_user_by_account_id", queries.GET_USER_SQL, ("acct_500",)),
+    ("get_class_students", queries.CLASS_STUDENTS_SQL, (2500,)),
+    ("list_sessions_for_class", queries.SESSIONS_FOR_CLASS_SQL, (2500,)),
+    ("list_sessions_with_stats", queries.SESSIONS_WITH_STATS_SQL, (2500,)),
+    ("list_session_attendance", queries.ATTENDANCE_LIST_SQL, (4000,)),
+    ("list_session_attendance (etag)", queries.ATTENDANCE_HEAD_SQL, (4000,)),
+    ("list_session_attendance (since)", queries.ATTENDANCE_SINCE_SQL, (4000, "0")),
+    ("write_attendance", queries.WRITE_ATTENDANCE_SQL, {"session_id": 4000, "student_id": 12345, "confidence": 0.9, "in_time": datetime(2025, 1, 1, 8, tzinfo=timezone.utc), "out_time": None}),
+]
+
+
+def seq_scans(plan: dict, large: set[str]) -> list[str]:
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in large:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found += seq_scans(child, large)
+    return found
+
+
+@pytest.fixture(scope="module")
+def conn():
+    if DATABASE_URL == os.getenv("DATABASE_URL"):
+        pytest.fail("Refusing to seed the application database; use a scratch database")
+    migrate(DATABASE_URL)
+    with psycopg.connect(DATABASE_URL) as conn:
+        if not conn.execute('SELECT EXISTS (SELECT 1 FROM "STUDENTS")').fetchone()[0]:
+            conn.execute(SEED_SQL.format(scale=SCALE))
+            conn.commit()
+        conn.execute("ANALYZE")
+        conn.commit()
+        yield conn
+
+
+@pytest.fixture(scope="module")
+def large_tables(conn) -> set[str]:
+    return {
+        row[0] for row in conn.execute(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace AND reltuples >= %s",
+            (MIN_ROWS,),
+        )
+    }
+
+
+@pytest.mark.parametrize("handler, sql, params", QUERIES, ids=[q[0] for q in QUERIES])
+def test_query_uses_indexes(conn, large_tables, handler, sql, params):
+    try:
+        plan = conn.execute("EXPLAIN (FORMAT JSON) " + sql, params).fetchone()[0][0]["Plan"]
+    finally:
+        conn.rollback()
+    scans = sorted(set(seq_scans(plan, large_tables)))
+    assert not scans, f"{handler} sequentially scans {', '.join(scans)}"
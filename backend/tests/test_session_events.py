@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("psycopg")
+
+from session_events import SessionEventHub, Subscriber
+
+
+def event(student_id: int | None, action: str = "in") -> dict:
+    return {"session_id": 7, "student_id": student_id, "action": action}
+
+
+def test_subscriber_keeps_latest_event_per_student_in_arrival_order():
+    sub = Subscriber(maxlen=10)
+    sub.push(1, event(1))
+    sub.push(2, event(2))
+    sub.push(3, event(1, "out"))
+    assert sub.drain() == [(2, event(2)), (3, event(1, "out"))]
+    assert sub.dropped == 1
+    assert sub.drain() == []
+
+
+def test_subscriber_drops_oldest_beyond_maxlen():
+    sub = Subscriber(maxlen=2)
+    for i in range(1, 4):
+        sub.push(i, event(i))
+    assert [event_id for event_id, _ in sub.drain()] == [2, 3]
+    assert sub.dropped == 1
+
+
+def test_subscriber_get_times_out_empty():
+    assert asyncio.run(Subscriber().get(0.01)) == []
+
+
+def test_replay_goes_by_ring_position_not_id_order():
+    hub = SessionEventHub()
+    # Relayed ids from two workers: arrival order differs from id order.
+    for event_id, student_id in [(100, 1), (300, 2), (200, 3), (400, 4)]:
+        hub.publish(7, event(student_id), event_id)
+    sub = hub.subscribe(7, last_event_id=300)
+    assert [event_id for event_id, _ in sub.drain()] == [200, 400]
+
+
+def test_replay_falls_back_to_ids_when_last_id_left_the_ring():
+    hub = SessionEventHub(ring_size=2)
+    for event_id, student_id in [(100, 1), (200, 2), (300, 3), (400, 4)]:
+        hub.publish(7, event(student_id), event_id)
+    sub = hub.subscribe(7, last_event_id=100)
+    assert [event_id for event_id, _ in sub.drain()] == [300, 400]
+
+
+def test_subscriber_receives_published_events_until_unsubscribed():
+    hub = SessionEventHub()
+    sub = hub.subscribe(7)
+    event_id = hub.publish(7, event(1))
+    hub.unsubscribe(7, sub)
+    hub.publish(7, event(2))
+    assert sub.drain() == [(event_id, event(1))]
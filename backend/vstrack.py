@@ -1,28 +1,90 @@
-import requests_async as requests
 import asyncio
 import os
+import json
+import time
 import cv2
 import numpy as np
 from av import VideoFrame
 from aiortc import VideoStreamTrack
 from datetime import datetime, timezone, timedelta
-from detect import detect_faces
+from capture import acquire_reader, release_reader, source_name
+from events import bus, SESSION_EVENT
+from attendance_buffer import buffer as attendance_buffer
+from live_state import store as live_store
+from typing import Callable
+from detect import analyse_faces, detect_faces
+from detection_log import log as detection_log
 
 IP_WEBCAM_URL = os.getenv("IP_WEBCAM_URL")
 
+_placeholders: dict[str, np.ndarray] = {}
+
+def placeholder_frame(text: str, pts, time_base) -> VideoFrame:
+    """
+    Black frame with a status line, sent while a source is unavailable.
+    The yuv420p image is rendered once per message, so serving it is a plain copy.
+    """
+    img = _placeholders.get(text)
+    if img is None:
+        bgr = np.zeros((480, 640, 3), dtype=np.uint8)
+        if text:
+            cv2.putText(bgr, text, (24, 460), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (200, 200, 200), 2)
+        img = cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV_I420)
+        _placeholders[text] = img
+    video_frame = VideoFrame.from_ndarray(img, format="yuv420p")
+    video_frame.pts = pts
+    video_frame.time_base = time_base
+    return video_frame
+
+def _to_yuv(frame: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420)
+
+def _relay_frame(frame, pts, time_base) -> VideoFrame:
+    """
+    A source frame, unscaled, as the next output frame. Decoded VideoFrames are
+    sent as they are; BGR camera images are wrapped and left to the encoder,
+    which converts them to yuv420p on its own thread.
+    """
+    video_frame = frame if isinstance(frame, VideoFrame) else VideoFrame.from_ndarray(frame, format="bgr24")
+    video_frame.pts = pts
+    video_frame.time_base = time_base
+    return video_frame
+
 class FaceDetectionTrack(VideoStreamTrack):
     """
-    VideoStreamTrack that performs face detection every `process_interval` frames.
-    Intermediate frames are relayed unmodified to keep FPS high.
+    VideoStreamTrack that performs face detection on the latest camera frame.
+    Capture runs on a background reader thread; when no new frame has arrived
+    since the last call, the previous output frame is sent again.
+
+    With `annotate=False` the source frames are relayed at their own size, without
+    boxes and without waiting for inference: decoded VideoFrames (RTMP, browser
+    camera, replay) are sent as they are, and detection runs in the background
+    on a downscaled copy of the newest frame. Results go to the registered
+    metadata listeners (WebRTC data channels) for the browser to draw.
     """
-    def __init__(self, students_list: dict[int, str], session_id: int | None = None, end_time_iso: str | None = None):
+    def __init__(self, students_list: dict[int, str], session_id: int | None = None, end_time_iso: str | None = None, source: str | None = None, annotate: bool = True):
         super().__init__()
-        self.cap = None
-        self.reconnect_attempts = 5
+        self.source = source or IP_WEBCAM_URL
+        self.source_name = source_name(self.source)
+        self.annotate = annotate
+        self.reader = acquire_reader(self.source)
+        self._reader_released = False
+        self._last_seq = 0
+        self._last_yuv: np.ndarray | None = None
+        self._last_source = None
+        self._analysed_seq = 0
+        self._analysis: asyncio.Future | None = None
+        self.metadata_listeners: set[Callable[[str], None]] = set()
+        # Per-frame stage timings of processed frames, collected when set to a list (bench.py).
+        self.stage_timings: list[dict[str, float]] | None = None
         self.students_list = students_list
         self.session_id = session_id
         self.attendance: dict[int, dict[str, object]] = {}
-        self._bulk_sent = False
+        self._flushed = False
+        self._live = False
+        if session_id:
+            live_store.open(session_id)
+            self._live = True
         self.end_time = None
         if end_time_iso:
             try:
@@ -32,8 +94,6 @@ class FaceDetectionTrack(VideoStreamTrack):
                 self.end_time = dt.astimezone(timezone.utc)
             except Exception:
                 self.end_time = None
-        self.api_base = os.getenv("API_BASE_URL") or "http://localhost:8080"
-        self.connect()
 
     def _record_event(self, student_id: int, confidence: float | None = None):
         if student_id not in self.students_list:
@@ -48,22 +108,8 @@ class FaceDetectionTrack(VideoStreamTrack):
                 "conf_sum": float(confidence) if (confidence is not None) else 0.0,
                 "conf_count": 1 if (confidence is not None) else 0,
             }
-            try:
-                asyncio.create_task(
-                    requests.post(
-                        f"{self.api_base}/api/sessions/{self.session_id}/events/notify",
-                        json={
-                            "student_id": student_id,
-                            "name": self.students_list.get(student_id),
-                            "action": "in",
-                            "time": now_local.isoformat(),
-                            "confidence": confidence,
-                        },
-                        timeout=2,
-                    )
-                )
-            except Exception:
-                pass
+            self._save(student_id)
+            self._publish_event(student_id, "in", now_local, confidence)
         else:
             in_time = rec.get("in_time")
             try:
@@ -82,105 +128,131 @@ class FaceDetectionTrack(VideoStreamTrack):
                 return
 
             rec["out_time"] = now_local
-            try:
-                asyncio.create_task(
-                    requests.post(
-                        f"{self.api_base}/api/sessions/{self.session_id}/events/notify",
-                        json={
-                            "student_id": student_id,
-                            "name": self.students_list.get(student_id),
-                            "action": "out",
-                            "time": now_local.isoformat(),
-                            "confidence": confidence,
-                        },
-                        timeout=2,
-                    )
-                )
-            except Exception:
-                pass
+            self._save(student_id)
+            self._publish_event(student_id, "out", now_local, confidence)
 
-    def _flush_bulk(self):
-        if self._bulk_sent or not self.session_id or not self.attendance:
-            return
+    def _publish_event(self, student_id: int, action: str, when: datetime, confidence: float | None):
+        bus.publish(SESSION_EVENT, {
+            "session_id": self.session_id,
+            "student_id": student_id,
+            "name": self.students_list.get(student_id),
+            "action": action,
+            "time": when.astimezone().isoformat(),
+            "confidence": confidence,
+        })
+
+    def _save(self, student_id: int):
+        """Hands the student's current record to the write-behind buffer."""
+        rec = self.attendance[student_id]
+        tin = rec.get("in_time")
+        tout = rec.get("out_time")
+        conf_avg = None
         try:
-            payload = []
-            for sid, rec in self.attendance.items():
-                tin = rec.get("in_time")
-                tout = rec.get("out_time")
-                conf_avg = None
-                try:
-                    cs = float(rec.get("conf_sum", 0.0))
-                    cc = int(rec.get("conf_count", 0))
-                    conf_avg = (cs / cc) if cc > 0 else None
-                except Exception:
-                    conf_avg = None
-                payload.append({
-                    "student_id": sid,
-                    "in_time": tin.isoformat() if isinstance(tin, datetime) else None,
-                    "out_time": tout.isoformat() if isinstance(tout, datetime) else None,
-                    "confidence": conf_avg,
-                })
-            asyncio.create_task(
-                requests.post(
-                    f"{self.api_base}/api/sessions/{self.session_id}/attendance/bulk",
-                    json=payload,
-                    timeout=3,
-                )
-            )
-            self._bulk_sent = True
+            cs = float(rec.get("conf_sum", 0.0))
+            cc = int(rec.get("conf_count", 0))
+            conf_avg = (cs / cc) if cc > 0 else None
         except Exception:
-            pass
+            conf_avg = None
+        tin = tin.astimezone() if isinstance(tin, datetime) else None
+        tout = tout.astimezone() if isinstance(tout, datetime) else None
+        attendance_buffer.put({
+            "session_id": self.session_id,
+            "student_id": student_id,
+            "in_time": tin.isoformat() if tin else None,
+            "out_time": tout.isoformat() if tout else None,
+            "confidence": conf_avg,
+        })
+        if tin is not None:
+            live_store.update(self.session_id, student_id, self.students_list.get(student_id), tin, tout, conf_avg)
 
-    def connect(self):
-        print("Attempting to connect to IP Webcam stream...")
-        self.cap = cv2.VideoCapture(IP_WEBCAM_URL)
-
-        if not self.cap.isOpened():
-            print(f"Could not open video stream from IP Webcam: {IP_WEBCAM_URL}")
-            self.cap = None
-        else:
-            print("Successfully connected to IP Webcam stream.")
+    def _flush(self):
+        if self._live:
+            # Unsaved records stay visible until the buffer has written the session out.
+            self._live = False
+            live_store.close(self.session_id)
+        if not self._flushed and self.session_id and self.attendance:
+            self._flushed = True
+            attendance_buffer.flush_soon()
 
     async def recv(self):
         pts, time_base = await self.next_timestamp()
 
         if self.end_time is not None and datetime.now(timezone.utc) >= self.end_time:
-            if self.cap and self.cap.isOpened():
-                self.cap.release()
-                self.cap = None
-
-            self._flush_bulk()
-            black_frame_img = np.zeros((480, 640, 3), dtype=np.uint8)
-            video_frame = VideoFrame.from_ndarray(black_frame_img, format="rgb24")
-            video_frame.pts = pts
-            video_frame.time_base = time_base
+            self._release_reader()
+            self._flush()
             await asyncio.sleep(0.2)
-            return video_frame
-
-        if self.cap is None:
-            self.connect()
-            black_frame_img = np.zeros((480, 640, 3), dtype=np.uint8)
-            video_frame = VideoFrame.from_ndarray(black_frame_img, format="rgb24")
-            video_frame.pts = pts
-            video_frame.time_base = time_base
-            await asyncio.sleep(1)
-            return video_frame
-
-        ret, frame = self.cap.read()
-
-        if not ret:
-            print("Could not read frame, potential connection loss.")
-            self.cap.release()
-            self.cap = None
-            black_frame_img = np.zeros((480, 640, 3), dtype=np.uint8)
-            video_frame = VideoFrame.from_ndarray(black_frame_img, format="rgb24")
-            video_frame.pts = pts
-            video_frame.time_base = time_base
-            return video_frame
+            return placeholder_frame("Session ended", pts, time_base)
 
+        frame, seq = self.reader.read()
+
+        if frame is None:
+            return placeholder_frame(f"Camera {self.reader.state}...", pts, time_base)
+
+        if not self.annotate:
+            if seq != self._last_seq or self._last_source is None:
+                self._last_source = frame
+                self._last_seq = seq
+                if seq != self._analysed_seq and (self._analysis is None or self._analysis.done()):
+                    self._analysed_seq = seq
+                    self._analysis = asyncio.ensure_future(self._analyse(frame, seq))
+            return _relay_frame(self._last_source, pts, time_base)
+        elif seq != self._last_seq or self._last_yuv is None:
+            loop = asyncio.get_event_loop()
+            self._last_yuv, detections, event = await loop.run_in_executor(None, self._annotate_frame, frame)
+            self._last_seq = seq
+            self._handle_event(event)
+            self._log_detections(seq, detections)
+
+        video_frame = VideoFrame.from_ndarray(self._last_yuv, format="yuv420p")
+        video_frame.pts = pts
+        video_frame.time_base = time_base
+
+        return video_frame
+
+    def _annotate_frame(self, frame):
+        """Blocking: inference-size conversion, detection and drawing of a new camera frame."""
+        timings = {} if self.stage_timings is not None else None
+        detections: list[dict] = []
+        start = time.perf_counter()
+        img = self.reader.prepare(frame)
+        prepared = time.perf_counter()
+        processed_frame, event = detect_faces(img, detections=detections, timings=timings)
+        drawn = time.perf_counter()
+        yuv = _to_yuv(processed_frame)
+        if timings is not None:
+            timings["prepare"] = prepared - start
+            timings["convert"] = time.perf_counter() - drawn
+            timings["total"] = time.perf_counter() - start
+            self.stage_timings.append(timings)
+        return yuv, detections, event
+
+    def _analyse_frame(self, frame) -> tuple[np.ndarray, list[dict], dict | None]:
+        """Blocking: inference-size copy of a source frame and what analyse_faces finds in it."""
+        timings = {} if self.stage_timings is not None else None
+        start = time.perf_counter()
+        img = self.reader.prepare(frame)
+        prepared = time.perf_counter()
+        detections, event = analyse_faces(img, timings=timings)
+        if timings is not None:
+            timings["prepare"] = prepared - start
+            timings["total"] = time.perf_counter() - start
+            self.stage_timings.append(timings)
+        return img, detections, event
+
+    async def _analyse(self, frame, seq: int):
         loop = asyncio.get_event_loop()
-        processed_frame, event = await loop.run_in_executor(None, detect_faces, frame)
+        try:
+            img, detections, event = await loop.run_in_executor(None, self._analyse_frame, frame)
+        except Exception as e:
+            print(f"Detection failed: {e}")
+            return
+        self._handle_event(event)
+        self._log_detections(seq, detections)
+        # Boxes are in inference coordinates; the browser scales them to the video.
+        h, w = img.shape[:2]
+        self._publish_metadata(seq, w, h, detections)
 
+    def _handle_event(self, event: dict | None):
         if event and self.session_id:
             conf = None
             try:
@@ -189,14 +261,49 @@ class FaceDetectionTrack(VideoStreamTrack):
                 conf = None
             self._record_event(int(event["attendee_id"]), conf)
 
-        video_frame = VideoFrame.from_ndarray(processed_frame, format="bgr24")
-        video_frame = video_frame.reformat(format="yuv420p")
-        video_frame.pts = pts
-        video_frame.time_base = time_base
+    def _log_detections(self, seq: int, detections: list[dict]):
+        if self.session_id:
+            detection_log.record(self.session_id, self.source_name, seq, detections)
 
-        return video_frame
+    def _publish_metadata(self, seq: int, width: int, height: int, detections: list[dict]):
+        if not self.metadata_listeners:
+            return
+        # Compact keys: boxes are [x, y, w, h] in the coordinates of a (w, h) frame.
+        msg = json.dumps({
+            "seq": seq,
+            "ts": round(time.time(), 3),
+            "w": width,
+            "h": height,
+            "faces": [
+                {
+                    "b": [d["box"][0], d["box"][1], d["box"][2] - d["box"][0], d["box"][3] - d["box"][1]],
+                    "s": d["status"],
+                    "id": d["label"],
+                    "n": self.students_list.get(d["label"]) if d["label"] is not None else None,
+                    "sim": round(d["similarity"], 3) if d["similarity"] is not None else None,
+                    "live": round(d["live_score"], 3),
+                }
+                for d in detections
+            ],
+        }, separators=(",", ":"))
+        for listener in list(self.metadata_listeners):
+            try:
+                listener(msg)
+            except Exception:
+                self.metadata_listeners.discard(listener)
+
+    def _release_reader(self):
+        if not self._reader_released:
+            self._reader_released = True
+            release_reader(self.source)
+
+    def stop(self):
+        super().stop()
+        if self._analysis is not None:
+            self._analysis.cancel()
+        self.metadata_listeners.clear()
+        self._release_reader()
+        self._flush()
 
     def __del__(self):
-        if self.cap and self.cap.isOpened():
-            self.cap.release()
-        self._flush_bulk()
+        self._release_reader()
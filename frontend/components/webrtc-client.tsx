@@ -21,8 +21,59 @@ export type WebRTCClientProps = {
   sessionId?: number;
   /** End time (ISO) when the run should auto-stop on both client and server */
   endTimeISO?: string;
+  /** Frame source on the server, e.g. "rtmp:room-101"; defaults to the configured IP webcam */
+  source?: string;
+  /** "client": receive plain video and draw detections sent over a data channel */
+  overlay?: "server" | "client";
+  /** Use this browser's camera as the classroom camera instead of a server-side source */
+  useLocalCamera?: boolean;
+  /** Requested capture resolution for the local camera */
+  captureWidth?: number;
+  captureHeight?: number;
 };
 
+type DetectionFace = { b: [number, number, number, number]; s: "ok" | "unknown" | "spoof"; id: number | null; n: string | null };
+type DetectionMessage = { seq: number; w: number; h: number; faces: DetectionFace[] };
+
+const OVERLAY_COLORS: Record<DetectionFace["s"], string> = {
+  ok: "#34d399",
+  unknown: "#facc15",
+  spoof: "#f87171",
+};
+
+/** Draws boxes in video-frame coordinates onto a canvas covering an `object-cover` video. */
+function drawDetections(canvas: HTMLCanvasElement, msg: DetectionMessage) {
+  const dpr = window.devicePixelRatio || 1;
+  const cw = canvas.clientWidth;
+  const ch = canvas.clientHeight;
+  if (canvas.width !== cw * dpr || canvas.height !== ch * dpr) {
+    canvas.width = cw * dpr;
+    canvas.height = ch * dpr;
+  }
+  const ctx = canvas.getContext("2d");
+  if (!ctx || !msg.w || !msg.h)
+    return;
+
+  ctx.setTransform(dpr, 0, 0, dpr, 0, 0);
+  ctx.clearRect(0, 0, cw, ch);
+  const scale = Math.max(cw / msg.w, ch / msg.h);
+  const ox = (cw - msg.w * scale) / 2;
+  const oy = (ch - msg.h * scale) / 2;
+
+  ctx.lineWidth = 2;
+  ctx.font = "600 14px sans-serif";
+  for (const face of msg.faces) {
+    const [x, y, w, h] = face.b;
+    const color = OVERLAY_COLORS[face.s] ?? OVERLAY_COLORS.ok;
+    ctx.strokeStyle = color;
+    ctx.fillStyle = color;
+    ctx.strokeRect(ox + x * scale, oy + y * scale, w * scale, h * scale);
+    const text = face.s === "spoof" ? "Bad" : face.s === "unknown" ? "Unknown" : face.n ?? "";
+    if (text)
+      ctx.fillText(text, ox + x * scale, oy + y * scale - 6);
+  }
+}
+
 export function WebRTCClient({ 
   className, 
   label, 
@@ -31,9 +82,15 @@ export function WebRTCClient({
   confidence = 0, 
   students, 
   sessionId, 
-  endTimeISO 
+  endTimeISO,
+  source,
+  overlay = "server",
+  useLocalCamera = false,
+  captureWidth = 1280,
+  captureHeight = 720,
 }: WebRTCClientProps) {
   const videoRef = React.useRef<HTMLVideoElement | null>(null);
+  const canvasRef = React.useRef<HTMLCanvasElement | null>(null);
 
   const [error, setError] = React.useState<string | null>(null);
   const [active, setActive] = React.useState(false);
@@ -45,12 +102,14 @@ export function WebRTCClient({
   if (!g.__webrtc_singleton) {
     g.__webrtc_singleton = {
       pc: null as RTCPeerConnection | null,
-      stream: null as MediaStream | null
+      stream: null as MediaStream | null,
+      local: null as MediaStream | null
     };
   }
   const singleton = g.__webrtc_singleton as {
     pc: RTCPeerConnection | null;
-    stream: MediaStream | null
+    stream: MediaStream | null;
+    local: MediaStream | null
   };
 
   React.useEffect(() => {
@@ -83,6 +142,37 @@ export function WebRTCClient({
       }
     };
 
+    if (useLocalCamera) {
+      try {
+        const local = await navigator.mediaDevices.getUserMedia({
+          video: { width: { ideal: captureWidth }, height: { ideal: captureHeight } },
+          audio: false,
+        });
+        singleton.local = local;
+        // Sent on the same transceiver the annotated video comes back on.
+        for (const track of local.getVideoTracks())
+          pc.addTrack(track, local);
+      }
+      catch (error: any) {
+        setError(error?.message || 'Could not access the camera.');
+        stopConnection();
+        return;
+      }
+    }
+
+    if (overlay === "client") {
+      // Detections are only useful while fresh: unordered and never retransmitted.
+      const channel = pc.createDataChannel("detections", { ordered: false, maxRetransmits: 0 });
+      channel.onmessage = (event) => {
+        if (!canvasRef.current)
+          return;
+        try {
+          drawDetections(canvasRef.current, JSON.parse(event.data));
+        }
+        catch {}
+      };
+    }
+
     const offer = await pc.createOffer({
       offerToReceiveVideo: true,
       offerToReceiveAudio: false,
@@ -101,6 +191,8 @@ export function WebRTCClient({
           students_list: students ? Object.fromEntries(students.map(s => [String(s.id), s.name])) : undefined,
           session_id: sessionId,
           end_time: endTimeISO,
+          source: useLocalCamera ? "client" : source,
+          overlay,
         }),
       });
 
@@ -159,6 +251,9 @@ export function WebRTCClient({
   return (
     <div className={"relative w-full h-full aspect-video rounded-2xl overflow-hidden border border-border/20 bg-gradient-to-br from-black/60 to-black/40 backdrop-blur-sm shadow-2xl " + (className ?? "")}>
       <video ref={videoRef} className="absolute inset-0 w-full h-full object-cover" autoPlay playsInline muted />
+      {overlay === "client" && (
+        <canvas ref={canvasRef} className="absolute inset-0 w-full h-full pointer-events-none" />
+      )}
 
       <div className="absolute inset-0 pointer-events-none">
         <div className="absolute inset-0 bg-gradient-to-t from-black/60 via-transparent to-black/20" />
@@ -384,9 +479,11 @@ export function WebRTCClient({
 export function stopWebRTCConnection() {
   // eslint-disable-next-line @typescript-eslint/no-explicit-any
   const g: any = globalThis as any;
-  const singleton = g.__webrtc_singleton as { pc: RTCPeerConnection | null; stream: MediaStream | null } | undefined;
+  const singleton = g.__webrtc_singleton as { pc: RTCPeerConnection | null; stream: MediaStream | null; local?: MediaStream | null } | undefined;
   if (!singleton) return;
   try { if (singleton.pc) singleton.pc.close(); } catch {}
+  try { singleton.local?.getTracks().forEach((t) => t.stop()); } catch {}
   singleton.pc = null;
   singleton.stream = null;
+  singleton.local = null;
 }
@@ -0,0 +1,120 @@
+"""
+Build the offline patch cache used for anti-spoof training.
+
+Every source image (ImageFolder layout: <source>/<class>/<image>) goes through
+the face detector exactly once; all requested scale/size patches and their FT
+targets are cropped from that single detection by a pool of worker processes
+and packed into one store per patch_info under <output>:
+
+    python generate_patch_cache.py --source ./datasets/raw --output ./datasets/patch_cache \
+        --patch_info 2.7_80x80 4_80x80 org_1_80x60 --workers 8
+
+Train against it with `train_dist.py --patch_cache ./datasets/patch_cache`.
+"""
+import argparse
+import os
+import time
+from multiprocessing import Pool
+
+import cv2
+
+from src.generate_patches import CropImage
+from src.data_io.dataset_folder import generate_FT
+from src.data_io.patch_store import (
+    parse_patch_info, ft_size, resize_ft, open_patch_store, close_patch_store
+)
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+_detector = None
+_cropper = None
+_configs = None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline multi-scale patch cache")
+    parser.add_argument("--source", required=True, help="ImageFolder root of full frames")
+    parser.add_argument("--output", required=True, help="patch cache root")
+    parser.add_argument("--patch_info", nargs="+", default=["2.7_80x80", "4_80x80", "org_1_80x60"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunksize", type=int, default=16)
+    return parser.parse_args()
+
+
+def list_samples(source):
+    classes = sorted(e.name for e in os.scandir(source) if e.is_dir())
+    samples = []
+    for label, cls in enumerate(classes):
+        for dirpath, _, filenames in sorted(os.walk(os.path.join(source, cls))):
+            for name in sorted(filenames):
+                if name.lower().endswith(IMG_EXTENSIONS):
+                    samples.append((os.path.join(dirpath, name), label))
+    return classes, samples
+
+
+def _init_worker(patch_infos):
+    global _detector, _cropper, _configs
+    # The detector is created per process; cv2.dnn nets cannot be shared.
+    from src.anti_spoof_predict import Detection
+    cv2.setNumThreads(1)
+    _detector = Detection()
+    _cropper = CropImage()
+    _configs = []
+    for patch_info in patch_infos:
+        scale, h_input, w_input, crop = parse_patch_info(patch_info)
+        _configs.append((scale, h_input, w_input, crop, ft_size(h_input, w_input)))
+
+
+def _process(sample):
+    path, label = sample
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    try:
+        bbox = _detector.get_bbox(img)
+    except Exception:
+        return None
+
+    patches = []
+    for scale, h_input, w_input, crop, (ft_h, ft_w) in _configs:
+        patch = _cropper.crop(org_img=img, bbox=bbox, scale=scale,
+                              out_w=w_input, out_h=h_input, crop=crop)
+        patches.append((patch, resize_ft(generate_FT(patch), ft_h, ft_w)))
+    return label, patches
+
+
+def main():
+    args = parse_args()
+    classes, samples = list_samples(args.source)
+    if not samples:
+        raise SystemExit("no images found under {}".format(args.source))
+    print("[cache] {} images, {} classes, patches: {}".format(len(samples), len(classes), ", ".join(args.patch_info)))
+
+    stores = []
+    for patch_info in args.patch_info:
+        root = os.path.join(args.output, patch_info)
+        stores.append((patch_info, root, open_patch_store(root, patch_info, len(samples), classes, len(samples))))
+
+    start = time.perf_counter()
+    count = skipped = 0
+    with Pool(args.workers, initializer=_init_worker, initargs=(args.patch_info,)) as pool:
+        for i, result in enumerate(pool.imap(_process, samples, chunksize=args.chunksize)):
+            if result is None:
+                skipped += 1
+                continue
+            label, patches = result
+            for (_, _, (images, ft, labels)), (patch, ft_map) in zip(stores, patches):
+                images[count] = patch
+                ft[count] = ft_map
+                labels[count] = label
+            count += 1
+            if (i + 1) % 1000 == 0:
+                print("[cache] {}/{} images, {:.1f} img/s".format(i + 1, len(samples), (i + 1) / (time.perf_counter() - start)))
+
+    for patch_info, root, arrays in stores:
+        close_patch_store(root, patch_info, arrays, count, classes, len(samples))
+    print("[cache] wrote {} samples ({} skipped) in {:.1f}s".format(count, skipped, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
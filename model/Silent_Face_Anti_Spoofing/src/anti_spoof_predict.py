@@ -16,10 +16,13 @@ MODEL_MAPPING = {
     'MiniFASNetV2SE': MiniFASNetV2SE
 }
 
+DETECTION_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "detection_model")
+
+
 class Detection:
     def __init__(self):
-        caffemodel = "D:\\Newfolder\\yp\\apt_attendance\\model\\Silent_Face_Anti_Spoofing\\src\\resources\\detection_model\\Widerface-RetinaFace.caffemodel"
-        deploy = "D:\\Newfolder\\yp\\apt_attendance\\model\\Silent_Face_Anti_Spoofing\\src\\resources\\detection_model\\deploy.prototxt"
+        caffemodel = os.path.join(DETECTION_MODEL_DIR, "Widerface-RetinaFace.caffemodel")
+        deploy = os.path.join(DETECTION_MODEL_DIR, "deploy.prototxt")
         self.detector = cv2.dnn.readNetFromCaffe(deploy, caffemodel)
         self.detector_confidence = 0.6
 
@@ -1,10 +1,12 @@
 
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
 from src.data_io.dataset_folder import DatasetFolderFT
+from src.data_io.patch_store import PatchStoreFT, is_patch_store
 from src.data_io import transform as trans
 
 
-def get_train_loader(conf):
+def get_train_loader(conf, rank=0, world_size=1):
     train_transform = trans.Compose([
         trans.ToPILImage(),
         trans.RandomResizedCrop(size=tuple(conf.input_size),
@@ -15,13 +17,26 @@ def get_train_loader(conf):
         trans.RandomHorizontalFlip(),
         trans.ToTensor()
     ])
-    root_path = '{}/{}'.format(conf.train_root_path, conf.patch_info)
-    trainset = DatasetFolderFT(root_path, train_transform,
-                               None, conf.ft_width, conf.ft_height)
+    cache_root = conf.get('patch_cache')
+    if cache_root and is_patch_store('{}/{}'.format(cache_root, conf.patch_info)):
+        # Patches and FT maps produced offline by generate_patch_cache.py
+        trainset = PatchStoreFT('{}/{}'.format(cache_root, conf.patch_info), train_transform)
+    else:
+        root_path = '{}/{}'.format(conf.train_root_path, conf.patch_info)
+        trainset = DatasetFolderFT(root_path, train_transform,
+                                   None, conf.ft_width, conf.ft_height)
+
+    # With several processes every rank sees a disjoint shard of the dataset;
+    # call `train_loader.sampler.set_epoch(epoch)` to reshuffle each epoch.
+    sampler = None
+    if world_size > 1:
+        sampler = DistributedSampler(trainset, num_replicas=world_size, rank=rank, shuffle=True)
     train_loader = DataLoader(
         trainset,
         batch_size=conf.batch_size,
-        shuffle=True,
-        pin_memory=True,
-        num_workers=16)
+        shuffle=sampler is None,
+        sampler=sampler,
+        pin_memory=conf.get('pin_memory', True),
+        num_workers=conf.get('num_workers', 16),
+        persistent_workers=conf.get('num_workers', 16) > 0)
     return train_loader
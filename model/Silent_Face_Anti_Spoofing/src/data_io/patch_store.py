@@ -0,0 +1,125 @@
+import os
+import json
+import cv2
+import torch
+import numpy as np
+from torch.utils.data import Dataset
+
+from src.utility import get_kernel, get_width_height
+
+# One directory per patch_info (e.g. "2.7_80x80") holding:
+#   images.npy  uint8   (N, h, w, 3)  BGR patches, ready for the train transform
+#   ft.npy      float32 (N, ft_h, ft_w) Fourier targets, already resized
+#   labels.npy  int64   (N,)
+#   meta.json   count / classes / patch geometry
+IMAGES_FILE = 'images.npy'
+FT_FILE = 'ft.npy'
+LABELS_FILE = 'labels.npy'
+META_FILE = 'meta.json'
+
+
+def parse_patch_info(patch_info):
+    """'2.7_80x80' -> (2.7, 80, 80, True); 'org_1_80x60' -> (1.0, 80, 60, False)"""
+    w_input, h_input = get_width_height(patch_info)
+    head = patch_info.split('_')[0]
+    if head == 'org':
+        return 1.0, h_input, w_input, False
+    return float(head), h_input, w_input, True
+
+
+def ft_size(h_input, w_input):
+    # Same FT geometry as update_config in default_config.py
+    kernel_size = get_kernel(h_input, w_input)
+    return 2 * kernel_size[0], 2 * kernel_size[1]
+
+
+def is_patch_store(path):
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+class PatchStoreFT(Dataset):
+    """
+    Drop-in replacement for DatasetFolderFT reading pre-cropped patches and
+    pre-computed FT maps from a store written by generate_patch_cache.py.
+    """
+    def __init__(self, root, transform=None, target_transform=None):
+        with open(os.path.join(root, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.root = root
+        self.transform = transform
+        self.target_transform = target_transform
+        self.classes = self.meta['classes']
+        self.count = int(self.meta['count'])
+        self.ft_height, self.ft_width = self.meta['ft_size']
+        self._images = None
+        self._ft = None
+        self._labels = None
+
+    def _open(self):
+        # Memory maps are opened lazily so every DataLoader worker gets its own.
+        self._images = np.load(os.path.join(self.root, IMAGES_FILE), mmap_mode='r')
+        self._ft = np.load(os.path.join(self.root, FT_FILE), mmap_mode='r')
+        self._labels = np.load(os.path.join(self.root, LABELS_FILE), mmap_mode='r')
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if self._images is None:
+            self._open()
+        sample = np.array(self._images[index])
+        ft_sample = torch.from_numpy(np.array(self._ft[index], dtype=np.float32))
+        ft_sample = torch.unsqueeze(ft_sample, 0)
+        target = int(self._labels[index])
+
+        if self.transform is not None:
+            sample = self.transform(sample)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return sample, ft_sample, target
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_images'] = state['_ft'] = state['_labels'] = None
+        return state
+
+
+def open_patch_store(root, patch_info, count, classes, sources):
+    """Pre-allocate the arrays of one patch store; returns (images, ft, labels) memmaps."""
+    _, h_input, w_input, _ = parse_patch_info(patch_info)
+    ft_h, ft_w = ft_size(h_input, w_input)
+    os.makedirs(root, exist_ok=True)
+    images = np.lib.format.open_memmap(os.path.join(root, IMAGES_FILE), mode='w+',
+                                       dtype=np.uint8, shape=(count, h_input, w_input, 3))
+    ft = np.lib.format.open_memmap(os.path.join(root, FT_FILE), mode='w+',
+                                   dtype=np.float32, shape=(count, ft_h, ft_w))
+    labels = np.lib.format.open_memmap(os.path.join(root, LABELS_FILE), mode='w+',
+                                       dtype=np.int64, shape=(count,))
+    _write_meta(root, patch_info, 0, classes, sources, (ft_h, ft_w))
+    return images, ft, labels
+
+
+def close_patch_store(root, patch_info, arrays, count, classes, sources):
+    """Flush the arrays and record how many leading rows are valid."""
+    for arr in arrays:
+        arr.flush()
+    _, h_input, w_input, _ = parse_patch_info(patch_info)
+    _write_meta(root, patch_info, count, classes, sources, ft_size(h_input, w_input))
+
+
+def _write_meta(root, patch_info, count, classes, sources, ft_hw):
+    meta = {
+        'patch_info': patch_info,
+        'count': count,
+        'classes': classes,
+        'sources': sources,
+        'ft_size': list(ft_hw),
+    }
+    tmp = os.path.join(root, META_FILE + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(root, META_FILE))
+
+
+def resize_ft(ft_map, ft_h, ft_w):
+    return cv2.resize(ft_map, (ft_w, ft_h)).astype(np.float32)
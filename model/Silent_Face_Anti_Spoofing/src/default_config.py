@@ -0,0 +1,50 @@
+from easydict import EasyDict
+from src.utility import make_if_not_exist, get_width_height, get_kernel, get_time
+
+
+def get_default_config():
+    conf = EasyDict()
+
+    # optimizer
+    conf.lr = 1e-1
+    conf.milestones = [10, 15, 22]
+    conf.gamma = 0.1
+    conf.epochs = 25
+    conf.momentum = 0.9
+    conf.batch_size = 1024
+
+    # model
+    conf.num_classes = 3
+    conf.input_channel = 3
+    conf.embedding_size = 128
+
+    # dataset
+    conf.train_root_path = './datasets/rgb_image'
+    conf.patch_cache = None
+    conf.num_workers = 16
+
+    # save file path
+    conf.snapshot_dir_path = './saved_logs/snapshot'
+    conf.log_path = './saved_logs/jobs'
+
+    # logging / checkpointing, counted in optimizer steps
+    conf.board_loss_every = 10
+    conf.save_every = 30
+    return conf
+
+
+def update_config(args, conf):
+    conf.patch_info = args.patch_info
+    w_input, h_input = get_width_height(args.patch_info)
+    conf.input_size = [h_input, w_input]
+    conf.kernel_size = get_kernel(h_input, w_input)
+    conf.ft_height = 2 * conf.kernel_size[0]
+    conf.ft_width = 2 * conf.kernel_size[1]
+
+    job_name = 'Anti_Spoofing_{}'.format(args.patch_info)
+    conf.job_name = job_name
+    conf.model_path = '{}/{}'.format(conf.snapshot_dir_path, job_name)
+    conf.log_path = '{}/{}/{}'.format(conf.log_path, job_name, get_time())
+    make_if_not_exist(conf.model_path)
+    make_if_not_exist(conf.log_path)
+    return conf
@@ -0,0 +1,61 @@
+import pickle
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+torch = pytest.importorskip("torch")
+
+from src.data_io.patch_store import (
+    PatchStoreFT, close_patch_store, ft_size, is_patch_store, open_patch_store, parse_patch_info
+)
+
+
+def test_parse_patch_info():
+    assert parse_patch_info('2.7_80x80') == (2.7, 80, 80, True)
+    assert parse_patch_info('org_1_80x60') == (1.0, 80, 60, False)
+
+
+def test_ft_size_matches_kernel():
+    assert ft_size(80, 80) == (10, 10)
+    assert ft_size(80, 60) == (10, 8)
+
+
+def write_store(root, count=3, valid=2):
+    images, ft, labels = open_patch_store(str(root), '2.7_80x80', count, ['0', '1'], count)
+    for i in range(valid):
+        images[i] = i
+        ft[i] = i / 10
+        labels[i] = i % 2
+    close_patch_store(str(root), '2.7_80x80', (images, ft, labels), valid, ['0', '1'], count)
+
+
+def test_store_round_trip(tmp_path):
+    root = tmp_path / '2.7_80x80'
+    write_store(root)
+    assert is_patch_store(str(root))
+
+    store = PatchStoreFT(str(root))
+    assert len(store) == 2
+    assert store.classes == ['0', '1']
+    sample, ft_sample, target = store[1]
+    assert sample.shape == (80, 80, 3) and sample.dtype == np.uint8 and int(sample[0, 0, 0]) == 1
+    assert ft_sample.shape == (1, 10, 10) and ft_sample.dtype == torch.float32
+    assert ft_sample[0, 0, 0].item() == pytest.approx(0.1)
+    assert target == 1
+
+
+def test_meta_counts_no_rows_until_closed(tmp_path):
+    root = tmp_path / '2.7_80x80'
+    open_patch_store(str(root), '2.7_80x80', 3, ['0', '1'], 3)
+    assert len(PatchStoreFT(str(root))) == 0
+
+
+def test_pickled_store_reopens_its_own_maps(tmp_path):
+    root = tmp_path / '2.7_80x80'
+    write_store(root)
+    store = PatchStoreFT(str(root), target_transform=str)
+    store[0]
+    clone = pickle.loads(pickle.dumps(store))
+    assert clone._images is None
+    assert clone[0][2] == '0'
@@ -0,0 +1,263 @@
+"""
+Data-parallel CPU training for MultiFTNet over torch.distributed (gloo).
+
+Single node, spawning the workers ourselves:
+
+    python train_dist.py --patch_info 2.7_80x80 --nproc 8
+
+Several nodes, launched with torchrun on every node:
+
+    torchrun --nnodes 4 --nproc-per-node 8 --rdzv-backend c10d \
+        --rdzv-endpoint head-node:29500 train_dist.py --patch_info 2.7_80x80
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch import nn, optim
+from torch.nn.parallel import DistributedDataParallel
+
+from src.default_config import get_default_config, update_config
+from src.data_io.dataset_loader import get_train_loader
+from src.model_lib.MultiFTNet import MultiFTNet
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Distributed CPU training of MultiFTNet")
+    parser.add_argument("--patch_info", type=str, default="2.7_80x80",
+                        help="[org_1_80x60 / 1_80x80 / 2.7_80x80 / 4_80x80]")
+    parser.add_argument("--nproc", type=int, default=1,
+                        help="processes to spawn when not launched by torchrun")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="intra-op threads per process (0: cores / local processes)")
+    parser.add_argument("--batch_size", type=int, default=None,
+                        help="per-process batch size (default: config batch size / world size)")
+    parser.add_argument("--epochs", type=int, default=None)
+    parser.add_argument("--num_workers", type=int, default=None,
+                        help="data loader workers per process")
+    parser.add_argument("--patch_cache", type=str, default=None,
+                        help="patch cache root written by generate_patch_cache.py")
+    parser.add_argument("--save_every", type=int, default=None,
+                        help="checkpoint every N optimizer steps")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue from the latest checkpoint of this patch_info")
+    parser.add_argument("--baseline_throughput", type=float, default=None,
+                        help="single-process samples/s, used to report scaling efficiency")
+    return parser.parse_args()
+
+
+def _sync_bn_stats(model, world_size):
+    """
+    Average BatchNorm running statistics across ranks.
+    nn.SyncBatchNorm only runs on accelerators, so on CPU every rank normalises
+    with its local batch and the running buffers are reconciled here instead.
+    """
+    for m in model.modules():
+        if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.track_running_stats:
+            dist.all_reduce(m.running_mean, op=dist.ReduceOp.SUM)
+            dist.all_reduce(m.running_var, op=dist.ReduceOp.SUM)
+            m.running_mean.div_(world_size)
+            m.running_var.div_(world_size)
+
+
+class DistTrainer:
+    def __init__(self, conf, rank, world_size, local_world_size):
+        self.conf = conf
+        self.rank = rank
+        self.world_size = world_size
+        self.local_world_size = local_world_size
+        self.step = 0
+        self.start_epoch = 0
+        self.ckpt_path = os.path.join(conf.model_path, "checkpoint_{}.pth".format(conf.patch_info))
+
+    def _log(self, msg):
+        if self.rank == 0:
+            print("[train] {}".format(msg), flush=True)
+
+    def _define_network(self):
+        model = MultiFTNet(num_classes=self.conf.num_classes,
+                           img_channel=self.conf.input_channel,
+                           embedding_size=self.conf.embedding_size,
+                           conv6_kernel=self.conf.kernel_size)
+        # Buffers are averaged explicitly in _sync_bn_stats rather than overwritten
+        # by rank 0 on every forward pass.
+        return DistributedDataParallel(model, broadcast_buffers=False)
+
+    def _save_state(self, epoch):
+        _sync_bn_stats(self.model.module, self.world_size)
+        if self.rank != 0:
+            return
+        state = {
+            "epoch": epoch,
+            "step": self.step,
+            "world_size": self.world_size,
+            "model": self.model.module.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "schedule_lr": self.schedule_lr.state_dict(),
+        }
+        tmp_path = self.ckpt_path + ".tmp"
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, self.ckpt_path)
+
+        # Inference weights in the layout AntiSpoofPredict expects ("<patch_info>_<model>.pth").
+        export_path = os.path.join(self.conf.model_path, "{}_MiniFASNetV2SE.pth".format(self.conf.patch_info))
+        torch.save(self.model.module.model.state_dict(), export_path)
+
+    def _load_state(self):
+        if not os.path.exists(self.ckpt_path):
+            self._log("no checkpoint at {}, starting from scratch".format(self.ckpt_path))
+            return
+        state = torch.load(self.ckpt_path, map_location="cpu")
+        self.model.module.load_state_dict(state["model"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.schedule_lr.load_state_dict(state["schedule_lr"])
+        self.start_epoch = int(state["epoch"]) + 1
+        self.step = int(state["step"])
+        self._log("resumed from epoch {} (step {})".format(state["epoch"], self.step))
+
+    def _global_throughput(self, samples, seconds):
+        t = torch.tensor([float(samples), float(seconds)])
+        dist.all_reduce(t, op=dist.ReduceOp.SUM)
+        total_samples = t[0].item()
+        mean_seconds = t[1].item() / self.world_size
+        return total_samples / mean_seconds if mean_seconds > 0 else 0.0
+
+    def train(self, resume=False, baseline_throughput=None):
+        conf = self.conf
+        self.model = self._define_network()
+        self.optimizer = optim.SGD(self.model.parameters(), lr=conf.lr,
+                                   weight_decay=5e-4, momentum=conf.momentum)
+        self.schedule_lr = optim.lr_scheduler.MultiStepLR(self.optimizer, conf.milestones, conf.gamma, -1)
+        if resume:
+            self._load_state()
+
+        train_loader = get_train_loader(conf, self.rank, self.world_size)
+        cls_criterion = nn.CrossEntropyLoss()
+        ft_criterion = nn.MSELoss()
+
+        self._log("world_size={} batch/process={} global batch={} threads/process={}".format(
+            self.world_size, conf.batch_size, conf.batch_size * self.world_size, torch.get_num_threads()))
+
+        run_samples, run_start = 0, time.perf_counter()
+        epoch_stats = []
+        for epoch in range(self.start_epoch, conf.epochs):
+            if train_loader.sampler is not None and hasattr(train_loader.sampler, "set_epoch"):
+                train_loader.sampler.set_epoch(epoch)
+            self.model.train()
+
+            epoch_samples, epoch_start = 0, time.perf_counter()
+            window_samples, window_start = 0, epoch_start
+            running_loss = 0.0
+            for sample, ft_sample, target in train_loader:
+                self.optimizer.zero_grad(set_to_none=True)
+                cls_out, ft_out = self.model(sample)
+                loss_cls = cls_criterion(cls_out, target)
+                loss_ft = ft_criterion(ft_out, ft_sample)
+                loss = 0.5 * loss_cls + 0.5 * loss_ft
+                loss.backward()
+                self.optimizer.step()
+
+                n = sample.size(0)
+                self.step += 1
+                epoch_samples += n
+                window_samples += n
+                running_loss += loss.item()
+
+                if self.step % conf.board_loss_every == 0:
+                    now = time.perf_counter()
+                    sps = self._global_throughput(window_samples, now - window_start)
+                    self._log("epoch {} step {} loss {:.4f} lr {:.5f} {:.1f} samples/s".format(
+                        epoch, self.step, running_loss / conf.board_loss_every,
+                        self.optimizer.param_groups[0]["lr"], sps))
+                    running_loss = 0.0
+                    window_samples, window_start = 0, now
+
+                if self.step % conf.save_every == 0:
+                    self._save_state(epoch - 1)
+
+            self.schedule_lr.step()
+            epoch_time = time.perf_counter() - epoch_start
+            epoch_sps = self._global_throughput(epoch_samples, epoch_time)
+            epoch_stats.append(epoch_sps)
+            run_samples += epoch_samples
+            self._save_state(epoch)
+            self._log("epoch {} done in {:.1f}s, {:.1f} samples/s".format(epoch, epoch_time, epoch_sps))
+
+        self._report(run_samples, time.perf_counter() - run_start, epoch_stats, baseline_throughput)
+
+    def _report(self, samples, seconds, epoch_stats, baseline_throughput):
+        overall = self._global_throughput(samples, seconds)
+        if self.rank != 0:
+            return
+        report = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "patch_info": self.conf.patch_info,
+            "world_size": self.world_size,
+            "local_world_size": self.local_world_size,
+            "threads_per_process": torch.get_num_threads(),
+            "batch_per_process": self.conf.batch_size,
+            "samples_per_sec": overall,
+            "samples_per_sec_per_process": overall / self.world_size,
+            "epoch_samples_per_sec": epoch_stats,
+        }
+        if baseline_throughput:
+            report["speedup"] = overall / baseline_throughput
+            report["scaling_efficiency"] = overall / (baseline_throughput * self.world_size)
+        with open(os.path.join(self.conf.log_path, "throughput.jsonl"), "a") as f:
+            f.write(json.dumps(report) + "\n")
+        self._log("throughput: {}".format(json.dumps(report)))
+
+
+def _configure(args, rank, world_size, local_world_size):
+    # update_config creates the snapshot/log directories and stamps log_path with
+    # the current time, so only rank 0 runs it and every rank uses its result.
+    shared = [update_config(args, get_default_config()) if rank == 0 else None]
+    dist.broadcast_object_list(shared, src=0)
+    conf = shared[0]
+    if args.batch_size is not None:
+        conf.batch_size = args.batch_size
+    else:
+        # Keep the global batch of the single-GPU recipe.
+        conf.batch_size = max(1, conf.batch_size // world_size)
+    if args.epochs is not None:
+        conf.epochs = args.epochs
+    if args.save_every is not None:
+        conf.save_every = args.save_every
+    if args.patch_cache is not None:
+        conf.patch_cache = args.patch_cache
+    conf.num_workers = args.num_workers if args.num_workers is not None else max(1, 16 // local_world_size)
+    conf.pin_memory = False
+
+    threads = args.threads or max(1, (os.cpu_count() or 1) // local_world_size)
+    torch.set_num_threads(threads)
+    return conf
+
+
+def run(rank, world_size, local_world_size, args):
+    dist.init_process_group(backend="gloo", rank=rank, world_size=world_size)
+    try:
+        conf = _configure(args, rank, world_size, local_world_size)
+        DistTrainer(conf, rank, world_size, local_world_size).train(
+            resume=args.resume, baseline_throughput=args.baseline_throughput)
+    finally:
+        dist.destroy_process_group()
+
+
+def _spawn_worker(local_rank, nproc, args):
+    run(local_rank, nproc, nproc, args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if "RANK" in os.environ and "WORLD_SIZE" in os.environ:
+        # Launched by torchrun: rendezvous details come from the environment.
+        run(int(os.environ["RANK"]), int(os.environ["WORLD_SIZE"]),
+            int(os.environ.get("LOCAL_WORLD_SIZE", 1)), args)
+    else:
+        os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+        os.environ.setdefault("MASTER_PORT", "29500")
+        mp.spawn(_spawn_worker, args=(args.nproc, args), nprocs=args.nproc, join=True)